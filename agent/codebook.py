@@ -0,0 +1,111 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+RESOURCE_KINDS = ["stock","usage"]
+
+
+class Codebook:
+    """Stable integer codes for hospitals, regions and resources.
+
+    Codes are assigned in order of first appearance and never reordered, new values are appended, so
+    codes stay valid across data drops and reloads. Frames keep `hospital` and `region` as categoricals
+    over these lists, which makes comparisons and joins integer operations.
+    """
+
+    FILE = "codebook.json"
+
+    def __init__(self,hospitals: list = (),regions: list = (),resources: list = ()):
+        self.hospitals = []
+        self.regions = []
+        self.resources = []
+        self.hospital_codes = {}
+        self.region_codes = {}
+        self.resource_codes = {}
+        self._extend(self.hospitals,self.hospital_codes,hospitals)
+        self._extend(self.regions,self.region_codes,regions)
+        self._extend(self.resources,self.resource_codes,resources)
+
+    @staticmethod
+    def _extend(values: list,codes: dict,new_values):
+        for value in new_values:
+            if value not in codes:
+                codes[value] = len(values)
+                values.append(value)
+
+    @classmethod
+    def from_frame(cls,df: pd.DataFrame,resources: list = None):
+        """Codebook of the hospitals and regions in `df`, resources from the `{resource}_stock` columns if not given"""
+        if resources is None:
+            resources = [col[:-len("_stock")] for col in df.columns if col.endswith("_stock")]
+        return cls(list(pd.unique(df["hospital"].astype(str))),
+                   list(pd.unique(df["region"].astype(str))) if "region" in df.columns else [],
+                   resources)
+
+    def resource_columns(self,kind: str):
+        return [f"{res}_{kind}" for res in self.resources]
+
+    def encode(self,hospitals):
+        """Integer codes of hospital names, -1 for unknown ones"""
+        return pd.Categorical(np.asarray(hospitals,dtype=object),categories=self.hospitals).codes.astype(int)
+
+    def encode_resources(self,resources):
+        return np.array([self.resource_codes.get(res,-1) for res in resources],dtype=int)
+
+    def categorize(self,df: pd.DataFrame):
+        """`df` with hospital and region as categoricals over the codebook, unseen values are added first"""
+        copied = False
+        for col,values,codes in (("hospital",self.hospitals,self.hospital_codes),("region",self.regions,self.region_codes)):
+            if col not in df.columns:
+                continue
+            column = df[col]
+            if isinstance(column.dtype,pd.CategoricalDtype) and list(column.cat.categories) == values:
+                continue
+            if not copied:
+                df = df.copy()
+                copied = True
+            column = column.astype(str)
+            self._extend(values,codes,pd.unique(column))
+            df[col] = pd.Categorical(column,categories=values)
+        return df
+
+    def resource_matrix(self,df: pd.DataFrame,kind: str = "stock"):
+        """(hospital, resource) array of `df`'s `{resource}_{kind}` values indexed by codes, nan where a hospital has no row"""
+        matrix = np.full((len(self.hospitals),len(self.resources)),np.nan)
+        if df.empty:
+            return matrix
+        codes = self.encode(df["hospital"])
+        known = codes >= 0
+        matrix[codes[known]] = df[self.resource_columns(kind)].to_numpy(dtype=float)[known]
+        return matrix
+
+    def to_dict(self):
+        return {"hospitals": self.hospitals,"regions": self.regions,"resources": self.resources}
+
+    @classmethod
+    def from_dict(cls,data: dict):
+        return cls(data.get("hospitals",[]),data.get("regions",[]),data.get("resources",[]))
+
+    def save(self,root: str):
+        with open(os.path.join(root,self.FILE),'w') as f:
+            json.dump(self.to_dict(),f)
+
+    @classmethod
+    def load(cls,root: str):
+        """Codebook saved under `root`, None for older saves without one"""
+        path = os.path.join(root,cls.FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path,'r') as f:
+            return cls.from_dict(json.load(f))
+
+
+def get_codebook(state: dict):
+    """The state's codebook, an empty one over the state's resources if it has none yet"""
+    codebook = state.get("codebook")
+    if codebook is None:
+        codebook = Codebook(resources=state.get("resource_names") or [])
+        state["codebook"] = codebook
+    return codebook
@@ -1,5 +1,6 @@
 from typing_extensions import TypedDict
 import pandas as pd
+import numpy as np
 from typing import List,Dict
 
 from .data.generate_data import SyntheticData
@@ -13,6 +14,10 @@ from dotenv import load_dotenv
 load_dotenv()
 
 SAVE_PATH = "./sim_data"
+OUTPUT_PATH = "./sim_outputs"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND","parquet")
+#estimated token budget of a recommendation prompt, the shared instruction prefix included
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET","2000"))
 
 MODEL_NAME = "gemini-2.5-flash-lite"
 llm_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
@@ -22,22 +27,39 @@ llm_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 class State(TypedDict):
     sim_date:datetime
     days_since_update: int
-    window_data: pd.DataFrame
+    codebook: object
+    window: object
     today_data: pd.DataFrame
-    tracking_data: pd.DataFrame
+    tracking: object
     distances: pd.DataFrame
+    distance_index: object
     shortages: list
     surpluses: list
     num_hospitals:int
     resource_names: list
     tracking_hosps: set
     report_data: dict
+    reports_per_day: int
+    reports: list
+    hospital_severity: Dict[str,str]
     today_forecasts : dict
+    forecast_matrix: np.ndarray
+    forecast_hospitals: list
     forecast_conclusions: list
     recommendation: str
     recommendation_justification: str
-    prev_recommendations: dict
+    recommendation_memory: object
     user_feedback:str
     recommendation_weights: Dict[str,float]
     recommendation_meta: dict
+    recommendation_slate: list
+    recommendation_rejected: bool
+    recommendation_situation: str
+    prompt_stats: dict
+    pending_deltas: list
+    node_error: str
+    wal_records: int
+    seed: int
+    stock_scale: float
+    offline: bool
     done: bool
\ No newline at end of file
@@ -16,48 +16,45 @@ class SyntheticData:
         self.hospitals = [f"hos_{i+1}" for i in range(self.n_hospitals)]
         os.makedirs(save_path,exist_ok=True)
 
-    def generate_data(self,seed = 42,start_date = datetime.today()) :
-        """Generates a simulation of n_weeks with random usage spikes and uses given resources"""
+    def generate_data(self,seed = 42,start_date = datetime.today(),stock_scale = 1.0) :
+        """Generates a simulation of n_weeks with random usage spikes and uses given resources.
+        Stocks are multiplied by `stock_scale` after usage is drawn, below 1 it creates shortages"""
 
         np.random.seed(seed)
         random.seed(seed)
+        rng = np.random.default_rng(seed)
 
+        n_days = 14
+        n_hosps = self.n_hospitals
+        n_res = len(self.resources)
         start = start_date - timedelta(days=13)
-        
-        data = []
-
-        for hospital in self.hospitals:
-            region = random.choice(self.regions)
-            date = start
-            for day in range(14):
-                resource_data = {}
-                for resource in self.resources:
-                    #randomly determine current stock for a resource and its base usage
-                    current_stock = random.randint(200,800)
-                    base_usage = random.randint(0,current_stock-100)
-
-                    resource_data[resource] = {"usage":base_usage,"stock" : current_stock}
-                
-                patients = random.randint(500,1000)
-                staff = random.randint(50,200)
-                current_entry = {"hospital":hospital,
-                                 "region":region,
-                                 "date":date,
-                                 "patients":patients,
-                                 "staff":staff
-                                 }
-                for resource in resource_data.keys():
-                    current_entry[f"{resource}_stock"] = resource_data[resource]["stock"]
-                    current_entry[f"{resource}_usage"] = resource_data[resource]["usage"]
-                data.append(current_entry)
-                date += timedelta(days=1)
-
-        df = pd.DataFrame(data)
+        dates = pd.date_range(start,periods=n_days,freq="D")
+
+        #randomly determine stock and base usage for the whole (hospital, day, resource) tensor in one draw
+        stock = rng.integers(200,801,size=(n_hosps,n_days,n_res))
+        usage = (rng.random(size=stock.shape)*(stock-99)).astype(np.int64)
+        if stock_scale != 1.0:
+            stock = (stock*stock_scale).astype(np.int64)
+        regions = rng.choice(self.regions,size=n_hosps)
+        patients = rng.integers(500,1001,size=(n_hosps,n_days))
+        staff = rng.integers(50,201,size=(n_hosps,n_days))
+
+        columns = {
+            "hospital": np.repeat(self.hospitals,n_days),
+            "region": np.repeat(regions,n_days),
+            "date": np.tile(dates,n_hosps),
+            "patients": patients.ravel(),
+            "staff": staff.ravel(),
+        }
+        for r,resource in enumerate(self.resources):
+            columns[f"{resource}_stock"] = stock[:,:,r].ravel()
+            columns[f"{resource}_usage"] = usage[:,:,r].ravel()
+
+        df = pd.DataFrame(columns)
         self.simulation = df
 
-        distances = np.random.randint(5,500,size=(self.n_hospitals,self.n_hospitals))
-        for i in range(self.n_hospitals):
-            distances[i][i] = 0
+        distances = rng.integers(5,500,size=(n_hosps,n_hosps))
+        np.fill_diagonal(distances,0)
         distance_df = pd.DataFrame(data=distances,index=self.hospitals,columns=self.hospitals)
         
         try:
@@ -93,7 +90,7 @@ class SyntheticData:
         ]
 
 
-        hospital_name = f"hosp_{random.randint(1,self.n_hospitals)}"
+        hospital_name = random.choice(self.hospitals)
         region_name = random.choice(self.regions)
         resource_name = random.choices(self.resources)
 
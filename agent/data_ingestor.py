@@ -1,10 +1,79 @@
 import pandas as pd
 
 
-from agent.core import State,llm_client,MODEL_NAME,SAVE_PATH
+from agent.core import State,llm_client,MODEL_NAME,SAVE_PATH,OUTPUT_PATH
 from agent.utils import parse_model_res
+from agent.validation import SEVERITY_ORDER,validate_report
 from google.genai import types
 from agent.data.generate_data import SyntheticData
+from agent.persistence import record_delta
+from agent.distance_index import DistanceIndex
+from agent.window import RollingWindow,get_window
+from agent.codebook import Codebook,get_codebook
+from agent.llm_cache import LLMCache,generate_cached,agenerate_cached
+
+import os
+import re
+import random
+import asyncio
+
+REPORT_PROMPT = """
+    You are an assistant that extracts structured information from healthcare text reports.
+    Your job is to analyze each report and produce a JSON object summarizing the event, even if details are partially missing.
+
+    INPUT TEXT: {text}
+
+    For input text, output only a valid JSON object with these fields:
+
+    hospital: the hospital mentioned, or null if unknown
+    region: the geographic region or city, or null if not stated
+    resource: what is affected (oxygen, ventilators, beds, staff, etc.)
+    event: one of [shortage, restock, maintenance, surge, stable, unknown]
+    change_estimate_pct: estimated percentage increase or decrease in resource use (integer, may be approximate)
+    reason: the event or cause described (e.g., “flood”, “heat wave”, “festival crowd”)
+    severity: serverity of the reason. choose one of [mild,moderate,severe,critical] mild is lowest severity, critical is highest severity.
+    confidence: a number from 0 to 1 showing how certain you are about your extraction, based on text clarity and specificity.
+
+    1.0 = completely certain
+    0.5 = partially inferred
+    0.2 = mostly guessing
+    **JSON format**
+    {{
+    "hospital":,
+    "region":,
+    "resource":,
+    "event":,
+    "change_estimate_pct",
+    "reason":,
+    "severity":,
+    "confidence":,
+    }}
+
+    If you cannot identify something, return null or unknown, but always include all fields.
+    Output JSON only, with no extra text.
+    """
+
+#identical reports skip the model round trip, kept across runs in sim_outputs
+report_cache = LLMCache(os.path.join(OUTPUT_PATH,"llm_cache.sqlite"))
+
+#known causes and the severity assumed for them when a report doesn't state one
+CAUSE_SEVERITY = {
+    "flood":"severe","flooding":"severe","earthquake":"severe","seismic activity":"severe",
+    "explosion":"severe","industrial accident":"severe","epidemic":"severe","infectious disease outbreak":"severe",
+    "heat wave":"moderate","rising temperatures":"moderate","blizzard":"moderate","extreme cold":"moderate",
+    "heavy rain":"moderate","monsoon rains":"moderate","storm":"moderate","high wind and rainfall":"moderate",
+    "flu outbreak":"mild","seasonal flu cases":"mild","pollen allergy surge":"mild","spring allergies":"mild",
+    "tourist season":"mild","tourist inflow":"mild","festival crowd":"mild","festival gatherings":"mild",
+}
+STABLE_PATTERN = re.compile(r"\b(no significant|stable operations|no shortages|normal activity)\b")
+SURGE_PATTERN = re.compile(r"\b(overwhelmed|higher|increased|rise|risen|strain|significant|surge)\b")
+SHORTAGE_PATTERN = re.compile(r"\b(shortage|logistical issues|running low)\b")
+PCT_PATTERN = re.compile(r"(?:risen|increased|rise|grown|up) by (?:about |around |roughly )?(\d+)\s*%")
+HOSPITAL_PATTERN = re.compile(r"\b(hos_\d+)\b")
+#below this the rule based extraction hands the report to the model
+FAST_PATH_MIN_CONFIDENCE = 0.7
+
+FAST_PATH_STATS = {"hits":0,"fallbacks":0}
 
 
 def ingest_knowledge(state:State):
@@ -16,36 +85,42 @@ def ingest_knowledge(state:State):
         num_hosps = state.get("num_hospitals")
         resources = state.get("resource_names")        
         sd = SyntheticData(SAVE_PATH,n_hospitals=num_hosps,resources=resources)
-        if state["window_data"].empty:
+        if get_window(state) is None:
 
-                sim_df,dist_df = sd.generate_data(start_date=state["sim_date"])
+                sim_df,dist_df = sd.generate_data(seed=state.get("seed",42),start_date=state["sim_date"],
+                                                  stock_scale=state.get("stock_scale",1.0))
+                codebook = Codebook(resources=sd.resources)
+                sim_df = codebook.categorize(sim_df)
                 today_df = sim_df
                 
                 state["today_date"] = state["sim_date"]
-                state["window_data"] = today_df
-                state["tracking_data"] = today_df
+                state["codebook"] = codebook
+                state["window"] = RollingWindow.from_frame(today_df,codebook)
                 state["tracking_hosps"] = set(today_df["hospital"].unique())
                 state["today_data"] = sim_df[sim_df["date"]==state["sim_date"]]
                 state["distances"] = dist_df
+                state["distance_index"] = DistanceIndex(dist_df)
                 state["resource_names"] = sd.resources
+                record_delta(state,"snapshot")
                 
         elif state["days_since_update"]>=14:
 
             print("INFO: Recieved new data!")
 
-            sim_df,_ = sd.generate_data(start_date=state["sim_date"])
+            sim_df,_ = sd.generate_data(seed=state.get("seed",42),start_date=state["sim_date"],
+                                        stock_scale=state.get("stock_scale",1.0))
+            sim_df = get_codebook(state).categorize(sim_df)
             today_df = sim_df
 
-            # window_data: will have data from last 14 entries
-            state["window_data"] = pd.concat((state["window_data"],state["today_data"]))
-            recent_dates = sorted(state["window_data"]["date"].unique())[-14:]
-            state["window_data"] = state["window_data"][state["window_data"]["date"].isin(recent_dates)]
-
-            state["tracking_data"] = state["window_data"][state["window_data"]["hospital"].isin(state["tracking_hosps"])]
+            #the window keeps the last 14 days
+            get_window(state).append(state["today_data"])
 
             #updating todays data
             state["today_data"] = sim_df[sim_df["date"]==state["sim_date"]]
             state["days_since_update"] = 0
+            state["recommendation_slate"] = []
+            state["recommendation_rejected"] = False
+            record_delta(state,"snapshot")
 
         if state["today_data"].empty:
             print("WARNING: today_data is empty! state['today_date']:", state["sim_date"])
@@ -61,6 +136,158 @@ def ingest_knowledge(state:State):
     
 
 
+def adjust_confidence(res_dict: dict):
+    """Lower the model's confidence for reports with missing location or low severity"""
+    if res_dict.get("confidence") is None:
+        return res_dict
+    if(res_dict.get("hospital")==None or res_dict.get("region")==None):
+        res_dict["confidence"] -= 0.1
+    if((res_dict.get("severity") or "").lower() in ['mild','moderate']):
+        res_dict["confidence"] -= 0.2
+    return res_dict
+
+def severity_rank(report: dict):
+    severity = (report.get("severity") or "").lower()
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else -1
+
+def rule_extract(report: str,resources: list,regions: list):
+    """Fill the report schema with regexes and keyword tables, confidence reflects how much was found"""
+    text = report.lower()
+
+    hospital = HOSPITAL_PATTERN.search(text)
+    region = next((reg for reg in regions if re.search(rf"\b{re.escape(reg.lower())}\b",text)),None)
+    resource = next((res for res in resources if re.search(rf"\b{re.escape(res.lower())}\b",text)),None)
+    reason = next((cause for cause in sorted(CAUSE_SEVERITY,key=len,reverse=True) if cause in text),None)
+    pct = PCT_PATTERN.search(text)
+    stated_severity = next((sev for sev in SEVERITY_ORDER if re.search(rf"\b{sev}\b",text)),None)
+
+    if STABLE_PATTERN.search(text):
+        event = "stable"
+    elif SHORTAGE_PATTERN.search(text):
+        event = "shortage"
+    elif SURGE_PATTERN.search(text):
+        event = "surge"
+    else:
+        event = "unknown"
+
+    if stated_severity:
+        severity = stated_severity
+    elif reason:
+        severity = CAUSE_SEVERITY[reason]
+    else:
+        severity = "mild" if event == "stable" else None
+
+    confidence = (
+        0.3*(resource is not None)
+        + 0.2*(event != "unknown")
+        + (0.2 if stated_severity else 0.1 if severity else 0)
+        + 0.2*(hospital is not None or region is not None)
+        + 0.1*(reason is not None or event == "stable")
+    )
+    return {
+        "hospital": hospital.group(1) if hospital else None,
+        "region": region,
+        "resource": resource,
+        "event": event,
+        "change_estimate_pct": int(pct.group(1)) if pct else (0 if event == "stable" else None),
+        "reason": reason,
+        "severity": severity,
+        "confidence": round(confidence,2),
+    }
+
+def fast_extract(report: str,resources: list,regions: list):
+    """Rule based extraction if it is confident enough, else None so the caller asks the model"""
+    res_dict = rule_extract(report,resources,regions)
+    if res_dict["confidence"] < FAST_PATH_MIN_CONFIDENCE or res_dict["severity"] is None:
+        FAST_PATH_STATS["fallbacks"] += 1
+        return None
+    FAST_PATH_STATS["hits"] += 1
+    res_dict = adjust_confidence(res_dict)
+    res_dict["confidence"] = round(res_dict["confidence"],2)
+    return res_dict
+
+def offline_extract(report: str,resources: list,regions: list):
+    """Rule based extraction whatever its confidence, for runs without a model"""
+    res_dict = rule_extract(report,resources,regions)
+    res_dict["severity"] = res_dict["severity"] or "mild"
+    return adjust_confidence(res_dict)
+
+def fast_path_hit_rate():
+    total = FAST_PATH_STATS["hits"] + FAST_PATH_STATS["fallbacks"]
+    return FAST_PATH_STATS["hits"] / total if total else 0.0
+
+def known_regions(state: State):
+    codebook = state.get("codebook")
+    return list(codebook.regions) if codebook is not None else []
+
+def hospital_regions(state: State):
+    window = get_window(state)
+    return window.hospital_regions() if window is not None else pd.Series(dtype=object)
+
+def known_hospitals(state: State):
+    codebook = state.get("codebook")
+    return codebook.hospitals if codebook is not None else []
+
+def report_parser(resources: list = (),regions: list = (),hospitals: list = ()):
+    """Parse for report answers, almost valid json is repaired and coerced to the report schema instead of asking again"""
+    def parse(text: str):
+        return validate_report(parse_model_res(text),resources,regions,hospitals)
+    return parse
+
+async def extract_report_async(client,report: str,semaphore: asyncio.Semaphore,retries: int = 3,base_delay: float = 0.5,resources: list = (),regions: list = (),hospitals: list = ()):
+    """Extract one report with bounded concurrency, retrying with exponential backoff and jitter"""
+    res_dict = fast_extract(report,resources,regions)
+    if res_dict is not None:
+        return res_dict
+    config = types.GenerateContentConfig(max_output_tokens=2000)
+    for attempt in range(retries+1):
+        try:
+            async with semaphore:
+                res_dict = await agenerate_cached(client,report_cache,MODEL_NAME,REPORT_PROMPT,report,
+                                                  parse=report_parser(resources,regions,hospitals),config=config)
+            return adjust_confidence(res_dict)
+        except Exception as e:
+            if attempt == retries:
+                print(f"ERROR: giving up on report after {retries+1} attempts {str(e)}")
+                return None
+            delay = base_delay * 2**attempt * (1 + random.random())
+            print(f"WARNING: report extraction failed ({str(e)}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+async def extract_reports(client,reports: list,concurrency: int = 8,retries: int = 3,base_delay: float = 0.5,resources: list = (),regions: list = (),hospitals: list = ()):
+    """Extract many reports concurrently, failed reports are dropped"""
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(extract_report_async(client,report,semaphore,retries,base_delay,resources,regions,hospitals) for report in reports))
+    return [res for res in results if res is not None]
+
+def hospital_severity(reports: list,hosp_regions: pd.Series):
+    """Most severe reported level per hospital, region wide reports count for every hospital in the region.
+    `hosp_regions` maps hospital names to their region"""
+    severities = {}
+    for report in sorted(reports,key=severity_rank):
+        if severity_rank(report) < 0:
+            continue
+        severity = report["severity"].lower()
+        if report.get("hospital") in hosp_regions.index:
+            severities[report["hospital"]] = severity
+        elif report.get("region"):
+            for hosp in hosp_regions.index[hosp_regions==str(report["region"]).lower()]:
+                severities[hosp] = severity
+    return severities
+
+def ingest_reports_batch(state: State,reports: list,client = llm_client,concurrency: int = 8):
+    """Extract a day's worth of reports at once and derive a severity for each hospital"""
+    results = asyncio.run(extract_reports(client,reports,concurrency=concurrency,
+                                          resources=state.get("resource_names",[]),regions=known_regions(state),
+                                          hospitals=known_hospitals(state)))
+    if not results:
+        raise Exception("No reports could be extracted")
+    state["reports"] = results
+    state["hospital_severity"] = hospital_severity(results,hospital_regions(state))
+    #the most severe report stays the global context for hospitals no report mentions
+    state["report_data"] = max(results,key=severity_rank)
+    return state
+
 def ingest_daily_reports(state: State):
     """Ingest and parse daily unstructured reports"""
     try:
@@ -68,58 +295,38 @@ def ingest_daily_reports(state: State):
         
         num_hosps = state.get("num_hospitals")
         resources = state.get("resource_names")
+        reports_per_day = state.get("reports_per_day",1)
 
         sd = SyntheticData(SAVE_PATH,num_hosps,resources)
 
-        daily_report = sd.generate_reports()
-
-        llm_prompt = f"""
-    You are an assistant that extracts structured information from healthcare text reports.
-    Your job is to analyze each report and produce a JSON object summarizing the event, even if details are partially missing.
-
-    INPUT TEXT: {daily_report}
-
-    For input text, output only a valid JSON object with these fields:
-
-    hospital: the hospital mentioned, or null if unknown
-    region: the geographic region or city, or null if not stated
-    resource: what is affected (oxygen, ventilators, beds, staff, etc.)
-    event: one of [shortage, restock, maintenance, surge, stable, unknown]
-    change_estimate_pct: estimated percentage increase or decrease in resource use (integer, may be approximate)
-    reason: the event or cause described (e.g., “flood”, “heat wave”, “festival crowd”)
-    severity: serverity of the reason. choose one of [mild,moderate,severe,critical] mild is lowest severity, critical is highest severity.
-    confidence: a number from 0 to 1 showing how certain you are about your extraction, based on text clarity and specificity.
-
-    1.0 = completely certain
-    0.5 = partially inferred
-    0.2 = mostly guessing
-    **JSON format**
-    {{
-    "hospital":,
-    "region":,
-    "resource":,
-    "event":,
-    "change_estimate_pct",
-    "reason":,
-    "severity":,
-    "confidence":,
-    }}
-
-    If you cannot identify something, return null or unknown, but always include all fields.
-    Output JSON only, with no extra text.
-    """
-        res = llm_client.models.generate_content(model = MODEL_NAME,contents=llm_prompt,config=types.GenerateContentConfig(max_output_tokens=2000))
-        res_dict = parse_model_res(res.text)
+        if state.get("offline"):
+            reports = [sd.generate_reports() for _ in range(reports_per_day)]
+            results = [offline_extract(report,resources,known_regions(state)) for report in reports]
+            state["reports"] = results
+            state["hospital_severity"] = hospital_severity(results,hospital_regions(state)) if reports_per_day > 1 else {}
+            state["report_data"] = max(results,key=severity_rank)
+        elif reports_per_day > 1:
+            reports = [sd.generate_reports() for _ in range(reports_per_day)]
+            state = ingest_reports_batch(state,reports)
+            print(f"INFO: extracted {len(state['reports'])}/{reports_per_day} reports")
+        else:
+            daily_report = sd.generate_reports()
 
-        if(res_dict["hospital"]==None or res_dict["region"]==None):
-            res_dict["confidence"] -= 0.1
-        if((res_dict.get("severity","")).lower() in ['mild','moderate']):
-            res_dict["confidence"] -= 0.2
+            res_dict = fast_extract(daily_report,resources,known_regions(state))
+            if res_dict is None:
+                res_dict = generate_cached(llm_client,report_cache,MODEL_NAME,REPORT_PROMPT,daily_report,
+                                           parse=report_parser(resources,known_regions(state),known_hospitals(state)),
+                                           config=types.GenerateContentConfig(max_output_tokens=2000))
+                res_dict = adjust_confidence(res_dict)
 
-        state["report_data"] = res_dict
+            state["report_data"] = res_dict
+            state["reports"] = [res_dict]
+            state["hospital_severity"] = {}
         state["today_date"] = state["sim_date"]
+        print(f"INFO: report fast path hit rate {fast_path_hit_rate():.0%}")
     except Exception as e:
         print(f"ERROR: during ingesting reports {str(e)}")
+        state["node_error"] = f"ingest_daily_reports: {str(e)}"
     return state
 
 
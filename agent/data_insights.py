@@ -2,13 +2,14 @@ import streamlit as st
 
 import pandas as pd
 from agent.core import State
+from agent.tracking import tracking_data
 
 
 
 def show_insights(state: State):
     st.title("Data Insights")
     try:
-        df = state.get("tracking_data").copy()
+        df = tracking_data(state).copy()
         df["date"] = pd.to_datetime(df["date"],errors="coerce").dt.date
         st.subheader("Overview")
         st.write(df.describe())
@@ -51,4 +52,37 @@ def show_insights(state: State):
     
     except Exception as e:
         print(f"ERROR: during insight showing {str(e)}")
-        print(type(e).__name__)
\ No newline at end of file
+        print(type(e).__name__)
+
+def show_performance(runs: list):
+    st.title("Performance")
+    try:
+        if not runs:
+            st.info("No graph runs recorded yet, get a recommendation first!")
+            return
+
+        last = runs[-1]
+        st.subheader(f"Last run ({last['started']})")
+        st.write(f"Total wall time: {last['wall_s']:.3f}s | CPU time: {last['cpu_s']:.3f}s")
+
+        node_rows = []
+        for node in last["nodes"]:
+            node_rows.append({
+                "node": node["node"],
+                "wall (s)": node["wall_s"],
+                "cpu (s)": node["cpu_s"],
+                "peak memory (MB)": round(node["peak_bytes"]/1e6,3) if node.get("peak_bytes") is not None else None,
+                "rows in": sum(f["rows"] for f in node["frames_in"].values()),
+                "rows out": sum(f["rows"] for f in node["frames_out"].values()),
+            })
+        st.dataframe(pd.DataFrame(node_rows), width="stretch")
+
+        st.subheader("Wall time per node over recent runs")
+        history = pd.DataFrame([
+            {"run": f"{i}: {run['started']}", "node": node["node"], "wall_s": node["wall_s"]}
+            for i,run in enumerate(runs) for node in run["nodes"]
+        ])
+        st.line_chart(history.pivot_table(index="run", columns="node", values="wall_s", aggfunc="sum"))
+    except Exception as e:
+        print(f"ERROR: during performance showing {str(e)}")
+        print(type(e).__name__)
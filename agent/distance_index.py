@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+class DistanceIndex:
+    """Integer coded hospitals over a NumPy copy of the distance matrix, for positional lookups"""
+
+    def __init__(self,distance_df: pd.DataFrame):
+        self.source = distance_df
+        self.hospitals = list(distance_df.index)
+        self.codes = {hosp: i for i,hosp in enumerate(self.hospitals)}
+        self.matrix = distance_df.reindex(columns=self.hospitals).to_numpy(dtype=float)
+
+    def code(self,hospital: str):
+        return self.codes[hospital]
+
+    def encode(self,hospitals: list):
+        return np.array([self.codes[hosp] for hosp in hospitals],dtype=int)
+
+    def distances(self,from_hosp: str,to_hosps: list):
+        return self.matrix[self.codes[from_hosp],self.encode(to_hosps)]
+
+    def nearest(self,from_codes: np.ndarray,to_codes: np.ndarray,k: int):
+        """Positions in `to_codes` of the k nearest to each of `from_codes`, one row per hospital, nearest first"""
+        dist = self.matrix[from_codes[:,None],to_codes[None,:]]
+        if k < len(to_codes):
+            order = np.argpartition(dist,k-1,axis=1)[:,:k]
+        else:
+            order = np.broadcast_to(np.arange(len(to_codes)),dist.shape)
+        ranked = np.argsort(np.take_along_axis(dist,order,axis=1),axis=1,kind="stable")
+        return np.take_along_axis(order,ranked,axis=1)
+
+
+def get_distance_index(state: dict):
+    """Distance index for the state's current distance matrix, rebuilt only if the matrix was replaced"""
+    index = state.get("distance_index")
+    if index is None or index.source is not state["distances"]:
+        index = DistanceIndex(state["distances"])
+        state["distance_index"] = index
+    return index
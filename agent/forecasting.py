@@ -1,99 +1,120 @@
 from agent.core import State
-import pandas as pd
+from agent.matching import match_transfers
+from agent.distance_index import get_distance_index
+from agent.window import get_window
+from agent.codebook import get_codebook
+import numpy as np
+from collections.abc import Sequence
+
+SEVERITY_SCORE = {"mild":1.05,"moderate":1.2,"severe":1.4,"critical":1.6}
+
+def forecast_tensor(usage: np.ndarray,multipliers: np.ndarray,window: int = 7):
+    """Latest usage plus the rolling mean of the last `window` daily changes, scaled per hospital"""
+    base = usage[:,-1,:]
+    if usage.shape[1] <= window:
+        trend = np.full_like(base,np.nan)
+    else:
+        #mean of the last `window` diffs telescopes to (last - value `window` days earlier) / window
+        trend = (usage[:,-1,:] - usage[:,-1-window,:]) / window
+    return base + trend * multipliers[:,None]
 
 def forecast_data(state: State):
     """Forecast resource use and potential shortages using a rolling average"""
     try:
         print("INFO: Forecasting Data")
-        window_df = state.get("tracking_data")
-        if not isinstance(window_df,pd.DataFrame):
-            raise Exception("Not found tracking data")
-        forecasts = {}
-        severity_score = {"mild":1.05,"moderate":1.2,"severe":1.4,"critical":1.6}
+        if state.get("window") is None:
+            raise Exception("Not found window data")
         report_data = state.get("report_data")
         if not isinstance(report_data,dict):
             raise Exception("Not found report data")
-        
+
         current_severity = report_data.get("severity")
-        for hospital in state["tracking_hosps"]:
-            hospital_df = window_df[window_df["hospital"]==hospital].sort_values("date")
-            hospital_forecasts = {}
-            for resource in state.get("resource_names",[]):
+        hospitals = sorted(state["tracking_hosps"])
+        resources = state.get("resource_names",[])
 
-                trend = hospital_df[f"{resource}_usage"].diff().rolling(window=7).mean().iloc[-1]
-                base = hospital_df[f"{resource}_usage"].iloc[-1]
-                res_forecast = base + trend * severity_score[current_severity]
-                hospital_forecasts[f"{resource}_forecast"] = res_forecast
-            forecasts[hospital] = hospital_forecasts
+        #the rolling window already holds usage with resources as an axis
+        res_idx = get_codebook(state).encode_resources(resources)
+        usage = get_window(state).resource_tensor("usage",hospitals)[:,:,res_idx]
+        #hospitals named by a report use their own severity, everyone else the global one
+        global_score = SEVERITY_SCORE[current_severity]
+        hosp_severity = state.get("hospital_severity") or {}
+        multipliers = np.array([SEVERITY_SCORE.get(hosp_severity.get(hosp),global_score) for hosp in hospitals],dtype=float)
+        predictions = forecast_tensor(usage,multipliers)
+
+        forecasts = {}
+        for h,hospital in enumerate(hospitals):
+            forecasts[hospital] = {f"{resource}_forecast": predictions[h,r] for r,resource in enumerate(resources)}
 
         # print(forecasts)
         state["today_forecasts"] = forecasts
+        state["forecast_matrix"] = predictions
+        state["forecast_hospitals"] = hospitals
     except Exception as e:
         print(f"ERROR: during forecasting data {str(e)}")
         print(f"{type(e).__name__}")
+        state["node_error"] = f"forecast_data: {str(e)}"
     return state
 
+class LazyConclusions(Sequence):
+    """Human readable conclusions over the fleet, strings are only built when read"""
+
+    def __init__(self,hospitals: list,resources: list,diffs: np.ndarray):
+        self.hospitals = hospitals
+        self.resources = resources
+        self.diffs = diffs
+
+    def __len__(self):
+        return self.diffs.size
+
+    def __getitem__(self,idx):
+        if isinstance(idx,slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("conclusion index out of range")
+        h,r = divmod(idx,len(self.resources))
+        hosp,res,diff = self.hospitals[h],self.resources[r],self.diffs[h,r]
+        if diff<0:
+            return f"{hosp} might face a SHORTAGE for {res} by {diff} units"
+        elif diff>100:
+            return f"{hosp} might have a SURPLUS for {res} by {diff} units"
+        return f"{hosp} might be stable for {res}"
+
 def draw_conclusions(state: State):
     """Draw conclusions based on the forecasts"""
     try:
         print("INFO: Drawing Conclusions")
-        conclusions = []
-        surpluses =  []
-        shortages = []
-
-        for hosp,preds in state["today_forecasts"].items():
-            for res in state.get("resource_names",[]):
-                #get latest stock for that resource
-                stock = state["tracking_data"].query("hospital==@hosp")[f"{res}_stock"].iloc[-1]
-                forecast = preds[f"{res}_forecast"]
-                diff = stock - forecast
-
-                if diff<0:
-                    conclusion = f"{hosp} might face a SHORTAGE for {res} by {diff} units"
-                    shortages.append({"hospital":hosp,"resource":res,"quantity":abs(diff)})
-                elif diff>100:
-                    conclusion = f"{hosp} might have a SURPLUS for {res} by {diff} units"
-                    surpluses.append({"hospital":hosp,"resource":res,"quantity":diff})
-                else:
-                    conclusion = f"{hosp} might be stable for {res}"
-                conclusions.append(conclusion)
-
-        # print(conclusions)
+        resources = state.get("resource_names",[])
+        hospitals = state.get("forecast_hospitals")
+        forecast = state.get("forecast_matrix")
+        if hospitals is None or forecast is None:
+            hospitals = list(state["today_forecasts"].keys())
+            forecast = np.array([[state["today_forecasts"][hosp][f"{res}_forecast"] for res in resources] for hosp in hospitals],dtype=float).reshape(len(hospitals),len(resources))
+
+        window = get_window(state)
+        res_idx = get_codebook(state).encode_resources(resources)
+        stock = window.latest("stock",window.encode(hospitals))[:,res_idx]
+        diffs = stock - forecast
+
+        #nan diffs compare false on both masks and stay stable like before
+        shortages = [{"hospital":hospitals[h],"resource":resources[r],"quantity":float(-diffs[h,r])} for h,r in zip(*np.nonzero(diffs<0))]
+        surpluses = [{"hospital":hospitals[h],"resource":resources[r],"quantity":float(diffs[h,r])} for h,r in zip(*np.nonzero(diffs>100))]
+
         state["shortages"] = shortages
         state["surpluses"] = surpluses
-        state["forecast_conclusions"] = conclusions
-        # print(conclusions)
-        # print(shortages)
-        # print(surpluses)
+        state["forecast_conclusions"] = LazyConclusions(hospitals,resources,diffs)
     except Exception as e:
         print(f"ERROR: during drawing conclusions from forecasts {str(e)}")
         print(f"{type(e).__name__}")
+        state["node_error"] = f"draw_conclusions: {str(e)}"
     return state
 
 def prepare_candidates(state: State):
     """Prepare potential candidates for recommendations"""
     print("INFO: Preparing Candidates")
     try:
-        candidates = []
-        distance_df = state["distances"]
-        # print(distance_df.head())
-        for short_entry in state["shortages"]:
-            providers = []
-            short_hosp = short_entry["hospital"]
-            short_resource = short_entry["resource"]
-            short_diff = short_entry["quantity"]
-
-            surplus_candidates = [entry for entry in state["surpluses"] if entry["resource"]==short_resource]
-            surplus_candidates = sorted(surplus_candidates, key=lambda x: distance_df.loc[short_hosp, x["hospital"]])
-            remaining_need = short_diff
-            for candidate in surplus_candidates:
-                disposable_surplus = 0.6*candidate["quantity"]
-                providers.append({"hospital":candidate["hospital"],"quantity":disposable_surplus})
-                if remaining_need - disposable_surplus <=0:
-                    break
-                remaining_need -= disposable_surplus
-            candidates.append({"short_hospital":short_hosp,"resource":short_resource,"shortage":short_diff,"providers":providers})
-        return candidates
+        return match_transfers(state["shortages"],state["surpluses"],get_distance_index(state))
     except Exception as e:
         print(f"ERROR: during preparing candidates {str(e)}")
         print(f"{type(e).__name__}")
@@ -0,0 +1,90 @@
+from langgraph.graph import StateGraph,START,END
+import pandas as pd
+
+from agent.core import State
+
+from agent.data_ingestor import ingest_knowledge,ingest_daily_reports
+from agent.forecasting import forecast_data,draw_conclusions
+from agent.recommendations import build_recommendations,get_feedback
+from agent.persistence import save_state
+from agent.memo import memoize_node
+from agent.instrumentation import instrument_node
+
+import datetime
+
+
+def new_state(**overrides):
+    """Fresh simulation state, fields can be overridden by keyword"""
+    state: State = {
+        "sim_date": datetime.datetime(2025,1,1),
+        "days_since_update":0,
+        "window": None,
+        "today_data": pd.DataFrame(),
+        "tracking": None,
+        "distances":pd.DataFrame(),
+        "shortages":[],
+        "surpluses":[],
+        "num_hospitals":0,
+        "resource_names":[],
+        "report_data": {},
+        "reports_per_day": 1,
+        "today_forecasts": {},
+        "forecast_conclusions": [],
+        "tracking_hosps": set(),
+        "recommendation": "",
+        "recommendation_justification":"",
+        "recommendation_meta":{},
+        "recommendation_slate": [],
+        "recommendation_rejected": False,
+        "recommendation_situation": "",
+        "user_feedback":"",
+        "recommendation_weights": {"cost":0.5,"coverage":0.5,"fairness":0.5,"urgency":0.5},
+        "pending_deltas": [],
+        "node_error": "",
+        "seed": 42,
+        "stock_scale": 1.0,
+        "offline": False,
+        "done":False
+    }
+    state.update(overrides)
+    return state
+
+def build_graph(persist: bool = True,instrument: bool = True):
+    """Compile the recommendation graph, headless runs can leave out saving and timing"""
+    wrap = instrument_node if instrument else (lambda fn: fn)
+    graph_builder = StateGraph(State)
+
+    #NODES
+
+    #nodes whose outputs only depend on the listed state fields are skipped when those are unchanged
+    graph_builder.add_node(wrap(ingest_knowledge))
+    graph_builder.add_node(wrap(memoize_node(
+        ingest_daily_reports,
+        reads=["sim_date","reports_per_day","num_hospitals","resource_names","window","offline"],
+        writes=["report_data","reports","hospital_severity","today_date"])))
+    graph_builder.add_node(wrap(memoize_node(
+        forecast_data,
+        reads=["window","tracking_hosps","resource_names","report_data","hospital_severity"],
+        writes=["today_forecasts","forecast_matrix","forecast_hospitals"])))
+    graph_builder.add_node(wrap(memoize_node(
+        draw_conclusions,
+        reads=["today_forecasts","forecast_matrix","forecast_hospitals","window","resource_names"],
+        writes=["shortages","surpluses","forecast_conclusions"])))
+    graph_builder.add_node(wrap(build_recommendations))
+    graph_builder.add_node(wrap(get_feedback))
+    if persist:
+        graph_builder.add_node(wrap(save_state))
+
+    #EDGES
+    graph_builder.add_edge(START,"ingest_knowledge")
+    graph_builder.add_edge("ingest_knowledge","ingest_daily_reports")
+    graph_builder.add_edge("ingest_daily_reports","forecast_data")
+    graph_builder.add_edge("forecast_data","draw_conclusions")
+    graph_builder.add_edge("draw_conclusions","build_recommendations")
+    if persist:
+        graph_builder.add_edge("build_recommendations","save_state")
+        graph_builder.add_edge("save_state",END)
+    else:
+        graph_builder.add_edge("build_recommendations",END)
+
+    return graph_builder.compile()
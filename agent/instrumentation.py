@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import uuid
+import datetime
+import functools
+import tracemalloc
+
+import pandas as pd
+
+from agent.core import OUTPUT_PATH
+
+PERF_LOG = os.path.join(OUTPUT_PATH,"perf.jsonl")
+
+
+def frame_sizes(state: dict):
+    """Rows, columns and shallow memory of every dataframe in the state"""
+    sizes = {}
+    for key,value in state.items():
+        if isinstance(value,pd.DataFrame):
+            sizes[key] = {"rows": int(value.shape[0]),"cols": int(value.shape[1]),"bytes": int(value.memory_usage(index=True).sum())}
+    return sizes
+
+
+class RunRecorder:
+    """Collects per node stats of one graph run and appends them as a single json line"""
+
+    def __init__(self,path: str = PERF_LOG):
+        self.path = path
+        self.current = None
+
+    def start_run(self):
+        self.current = {
+            "run_id": uuid.uuid4().hex[:12],
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "nodes": [],
+        }
+
+    def record(self,stats: dict):
+        if self.current is None:
+            self.start_run()
+        self.current["nodes"].append(stats)
+
+    def finish_run(self):
+        """Write the current run to the perf log and return it, None if nothing ran"""
+        run = self.current
+        self.current = None
+        if run is None:
+            return None
+        run["wall_s"] = round(sum(node["wall_s"] for node in run["nodes"]),6)
+        run["cpu_s"] = round(sum(node["cpu_s"] for node in run["nodes"]),6)
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".",exist_ok=True)
+            with open(self.path,'a') as f:
+                f.write(json.dumps(run) + "\n")
+        except Exception as e:
+            print(f"ERROR: during writing perf log {str(e)}")
+        return run
+
+    def load_runs(self,limit: int = 50):
+        """Most recent runs from the perf log, oldest first"""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path,'r') as f:
+            lines = f.readlines()[-limit:]
+        runs = []
+        for line in lines:
+            try:
+                runs.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return runs
+
+
+recorder = RunRecorder()
+
+
+def instrument_node(fn,run_recorder: RunRecorder = None,trace_memory: bool = True):
+    """Wrap a graph node to record wall time, cpu time, peak traced memory and dataframe sizes in and out"""
+    run_recorder = run_recorder or recorder
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        frames_in = frame_sizes(state)
+        started_tracing = False
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            mem_before,_ = tracemalloc.get_traced_memory()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            return_state = fn(state)
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            peak = None
+            if trace_memory:
+                _,peak_traced = tracemalloc.get_traced_memory()
+                peak = peak_traced - mem_before
+                if started_tracing:
+                    tracemalloc.stop()
+
+        run_recorder.record({
+            "node": fn.__name__,
+            "wall_s": round(wall,6),
+            "cpu_s": round(cpu,6),
+            "peak_bytes": peak,
+            "frames_in": frames_in,
+            "frames_out": frame_sizes(return_state) if isinstance(return_state,dict) else {},
+        })
+        return return_state
+
+    return wrapper
@@ -0,0 +1,103 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text: str):
+    """Case and whitespace insensitive form of a text, so trivially different reports share a key"""
+    return " ".join(str(text).split()).casefold()
+
+def template_hash(template: str):
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMCache:
+    """Content addressed cache of model responses, a bounded in-memory LRU in front of a sqlite table"""
+
+    def __init__(self,db_path: str,max_entries: int = 256):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        #opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path),exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path,check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created REAL)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(text: str,model: str,template: str):
+        raw = "\x1f".join((normalize_text(text),model,template_hash(template)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self,key: str,response: str):
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self,key: str):
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+            row = self._db().execute("SELECT response FROM responses WHERE key = ?",(key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key,row[0])
+            self.hits += 1
+            return row[0]
+
+    def put(self,key: str,response: str):
+        with self._lock:
+            self._remember(key,response)
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",(key,response,time.time()))
+            db.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def generate_cached(client,cache: LLMCache,model: str,template: str,text: str,parse,config = None):
+    """Fill `template` with `text` and ask the model, unless an identical request was answered before.
+
+    Responses are only cached once `parse` accepts them, so a malformed answer is retried next time.
+    """
+    key = cache.make_key(text,model,template)
+    cached = cache.get(key)
+    if cached is not None:
+        return parse(cached)
+
+    prompt = template.format(text=text)
+    res = client.models.generate_content(model=model,contents=prompt,config=config)
+    parsed = parse(res.text)
+    cache.put(key,res.text)
+    return parsed
+
+async def agenerate_cached(client,cache: LLMCache,model: str,template: str,text: str,parse,config = None):
+    """Async twin of generate_cached, goes through the client's `aio` interface"""
+    key = cache.make_key(text,model,template)
+    cached = cache.get(key)
+    if cached is not None:
+        return parse(cached)
+
+    prompt = template.format(text=text)
+    res = await client.aio.models.generate_content(model=model,contents=prompt,config=config)
+    parsed = parse(res.text)
+    cache.put(key,res.text)
+    return parsed
@@ -0,0 +1,97 @@
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix,vstack
+
+from agent.distance_index import DistanceIndex
+
+#share of a surplus that a hospital is willing to give away
+DISPOSABLE_SHARE = 0.6
+#nearest surpluses each shortage may draw from in the solver, keeps the problem linear in the fleet size
+MAX_PROVIDERS = 8
+#interior point with crossover, several times faster than simplex on these problems and still ends on a vertex
+LP_METHOD = "highs-ipm"
+
+
+def greedy_transfers(shortages: list,surpluses: list,dist_index: DistanceIndex):
+    """Fill each shortage from its nearest surpluses, one shortage at a time"""
+    candidates = []
+    for short_entry in shortages:
+        providers = []
+        short_hosp = short_entry["hospital"]
+        short_resource = short_entry["resource"]
+        short_diff = short_entry["quantity"]
+
+        surplus_candidates = [entry for entry in surpluses if entry["resource"]==short_resource]
+        order = np.argsort(dist_index.distances(short_hosp,[entry["hospital"] for entry in surplus_candidates]),kind="stable")
+        surplus_candidates = [surplus_candidates[i] for i in order]
+        remaining_need = short_diff
+        for candidate in surplus_candidates:
+            disposable_surplus = DISPOSABLE_SHARE*candidate["quantity"]
+            providers.append({"hospital":candidate["hospital"],"quantity":disposable_surplus})
+            if remaining_need - disposable_surplus <=0:
+                break
+            remaining_need -= disposable_surplus
+        candidates.append({"short_hospital":short_hosp,"resource":short_resource,"shortage":short_diff,"providers":providers})
+    return candidates
+
+def solve_transport(supply: np.ndarray,demand: np.ndarray,pair_sup: np.ndarray,pair_short: np.ndarray,cost: np.ndarray):
+    """Amount moved along every (surplus, shortage) pair: the most coverage, then the least distance for it"""
+    n_pairs = len(pair_sup)
+    rows = np.concatenate((pair_sup,len(supply) + pair_short))
+    cols = np.concatenate((np.arange(n_pairs),np.arange(n_pairs)))
+    A_ub = coo_matrix((np.ones(2*n_pairs),(rows,cols)),shape=(len(supply)+len(demand),n_pairs)).tocsr()
+    b_ub = np.concatenate((supply,demand))
+
+    #phase one, the largest total that can be moved
+    res = linprog(-np.ones(n_pairs),A_ub=A_ub,b_ub=b_ub,bounds=(0,None),method=LP_METHOD)
+    if not res.success:
+        raise RuntimeError(f"transfer solver failed: {res.message}")
+    covered = -res.fun
+
+    #phase two, the shortest trips that still move it, less the solver's tolerance
+    A_ub = vstack((A_ub,-np.ones((1,n_pairs)))).tocsr()
+    b_ub = np.append(b_ub,-(covered - 1e-7*max(covered,1.0)))
+    res = linprog(cost,A_ub=A_ub,b_ub=b_ub,bounds=(0,None),method=LP_METHOD)
+    if not res.success:
+        raise RuntimeError(f"transfer solver failed: {res.message}")
+    return res.x
+
+def optimal_transfers(shortages: list,surpluses: list,dist_index: DistanceIndex,max_providers: int = MAX_PROVIDERS):
+    """Solve each resource's transfers as one transportation problem over every shortage's nearest surpluses"""
+    providers = [[] for _ in shortages]
+    short_resources = np.array([entry["resource"] for entry in shortages])
+    surplus_resources = np.array([entry["resource"] for entry in surpluses])
+    supply = np.array([DISPOSABLE_SHARE*entry["quantity"] for entry in surpluses],dtype=float)
+    demand = np.array([entry["quantity"] for entry in shortages],dtype=float)
+    short_codes = dist_index.encode([entry["hospital"] for entry in shortages])
+    sup_codes = dist_index.encode([entry["hospital"] for entry in surpluses])
+
+    #resources never share a hospital's stock, so each one is a separate and much smaller problem
+    for resource in dict.fromkeys(short_resources.tolist()):
+        short_idx = np.flatnonzero(short_resources==resource)
+        sup_idx = np.flatnonzero(surplus_resources==resource)
+        if not len(sup_idx):
+            continue
+        nearest = dist_index.nearest(short_codes[short_idx],sup_codes[sup_idx],max_providers)
+        pair_short = np.repeat(np.arange(len(short_idx)),nearest.shape[1])
+        pair_sup = nearest.ravel()
+        cost = dist_index.matrix[short_codes[short_idx][pair_short],sup_codes[sup_idx][pair_sup]]
+
+        moved = solve_transport(supply[sup_idx],demand[short_idx],pair_sup,pair_short,cost)
+        #anything below a thousandth of a unit is solver noise, not a transfer
+        used = np.flatnonzero(moved > 1e-3)
+        for k in used[np.argsort(cost[used],kind="stable")]:
+            providers[short_idx[pair_short[k]]].append({"hospital":surpluses[sup_idx[pair_sup[k]]]["hospital"],"quantity":float(moved[k])})
+
+    return [
+        {"short_hospital":entry["hospital"],"resource":entry["resource"],"shortage":entry["quantity"],"providers":providers[j]}
+        for j,entry in enumerate(shortages)
+    ]
+
+def match_transfers(shortages: list,surpluses: list,dist_index: DistanceIndex):
+    """Globally optimal transfers, falling back to the greedy matcher if the solver fails"""
+    try:
+        return optimal_transfers(shortages,surpluses,dist_index)
+    except Exception as e:
+        print(f"WARNING: optimal transfer matching failed ({str(e)}), using greedy matching")
+        return greedy_transfers(shortages,surpluses,dist_index)
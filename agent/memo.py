@@ -0,0 +1,78 @@
+import hashlib
+import functools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def _feed(h,value):
+    """Feed a stable byte representation of `value` into the hash"""
+    if isinstance(value,pd.DataFrame):
+        h.update(repr((list(value.columns),value.shape)).encode())
+        h.update(pd.util.hash_pandas_object(value,index=False).to_numpy().tobytes())
+    elif isinstance(value,pd.Series):
+        h.update(pd.util.hash_pandas_object(value,index=False).to_numpy().tobytes())
+    elif isinstance(value,np.ndarray):
+        h.update(repr((value.dtype.str,value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif hasattr(value,"fingerprint_parts"):
+        _feed(h,value.fingerprint_parts())
+    elif isinstance(value,dict):
+        h.update(b"{")
+        for key in sorted(value,key=repr):
+            _feed(h,key)
+            _feed(h,value[key])
+        h.update(b"}")
+    elif isinstance(value,(set,frozenset)):
+        h.update(b"<")
+        for item in sorted(value,key=repr):
+            _feed(h,item)
+        h.update(b">")
+    elif isinstance(value,(list,tuple)):
+        h.update(b"[")
+        for item in value:
+            _feed(h,item)
+        h.update(b"]")
+    else:
+        h.update(repr(value).encode())
+    h.update(b"|")
+
+def fingerprint(*values):
+    """Content hash of state values, equal for equal data regardless of object identity"""
+    h = hashlib.blake2b(digest_size=16)
+    for value in values:
+        _feed(h,value)
+    return h.hexdigest()
+
+
+def memoize_node(fn,reads: list,writes: list,max_entries: int = 8):
+    """Wrap a graph node so it is skipped when the state fields it reads are unchanged.
+
+    The cache is keyed on a fingerprint of `reads`; on a hit the stored `writes` are copied into
+    the state instead of running the node. Nodes report a caught failure in state["node_error"] and
+    such runs are not cached, so the same inputs are retried on the next run.
+    """
+    cache = OrderedDict()
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        key = fingerprint(*(state.get(field) for field in reads))
+        state["node_error"] = ""
+        if key in cache:
+            cache.move_to_end(key)
+            print(f"INFO: {fn.__name__} inputs unchanged, reusing cached results")
+            state.update(cache[key])
+            return state
+
+        state = fn(state)
+        if state.get("node_error"):
+            print(f"WARNING: {fn.__name__} failed, not caching its results")
+            return state
+        cache[key] = {field: state[field] for field in writes if field in state}
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+        return state
+
+    wrapper.cache = cache
+    return wrapper
@@ -0,0 +1,150 @@
+import os
+import json
+
+import numpy as np
+
+from agent.utils import get_model,preload_model,model_ready,dims
+
+
+class RecommendationMemory:
+    """Past recommendations in a faiss index keyed by embeddings of the situation they were made in"""
+
+    INDEX_FILE = "recommendations.faiss"
+    META_FILE = "recommendations.json"
+
+    def __init__(self,model = None,ann_threshold: int = 5000,dedupe_distance: float = 0.1):
+        self._model = model
+        self.ann_threshold = ann_threshold
+        #squared L2 between unit vectors, 0.1 is roughly a cosine similarity of 0.95
+        self.dedupe_distance = dedupe_distance
+        self.situations = []
+        self.texts = []
+        #entries added while the embedding model is still loading
+        self.pending = []
+        self.index = self._flat_index()
+        self.dirty = False
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_model()
+        return self._model
+
+    def ready(self):
+        """Whether the embedding model is loaded, starts loading it if not"""
+        if self._model is not None or model_ready():
+            return True
+        preload_model()
+        return False
+
+    @staticmethod
+    def _flat_index():
+        from faiss import IndexFlatL2
+        return IndexFlatL2(dims)
+
+    @property
+    def is_ann(self):
+        return not type(self.index).__name__.startswith("IndexFlat")
+
+    def __len__(self):
+        return len(self.texts) + len(self.pending)
+
+    def _encode(self,texts: list):
+        return np.asarray(self.model.encode(texts,normalize_embeddings=True),dtype="float32").reshape(len(texts),-1)
+
+    def _maybe_upgrade(self):
+        """Swap the flat index for HNSW once exact search gets too slow"""
+        if self.is_ann or len(self.texts) <= self.ann_threshold:
+            return
+        import faiss
+        print(f"INFO: recommendation memory has {len(self.texts)} entries, switching to an HNSW index")
+        vectors = self.index.reconstruct_n(0,self.index.ntotal)
+        index = faiss.IndexHNSWFlat(dims,32)
+        index.add(vectors)
+        self.index = index
+
+    def add(self,situation: str,text: str):
+        """Remember the recommendation `text` made for `situation`, unless it was already made for a near identical one"""
+        if not situation or not text:
+            return False
+        self.pending.append((situation,text))
+        self.dirty = True
+        self._flush()
+        return True
+
+    def _flush(self):
+        """Embed and index the pending entries once the model is ready"""
+        if not self.pending or not self.ready():
+            return
+        pending,self.pending = self.pending,[]
+        embs = self._encode([situation for situation,_ in pending])
+        for (situation,text),emb in zip(pending,embs):
+            emb = emb.reshape(1,-1)
+            if self.index.ntotal:
+                distance,ids = self.index.search(emb,1)
+                if distance[0,0] < self.dedupe_distance and self.texts[ids[0,0]] == text:
+                    continue
+            self.index.add(emb)
+            self.situations.append(situation)
+            self.texts.append(text)
+        self._maybe_upgrade()
+
+    def search(self,situation: str,k: int = 3):
+        """Recommendations made in the k stored situations closest to `situation` as (text, distance) pairs, none while the model loads"""
+        if not situation or not (self.index.ntotal or self.pending):
+            return []
+        self._flush()
+        if not self.index.ntotal or not self.ready():
+            return []
+        distances,ids = self.index.search(self._encode([situation]),min(k,self.index.ntotal))
+        return [(self.texts[i],float(d)) for d,i in zip(distances[0],ids[0]) if i >= 0]
+
+    def save(self,root: str):
+        """Write the index and entries, each replaced atomically, only if something was added"""
+        if not self.dirty:
+            return
+        self._flush()
+        import faiss
+        os.makedirs(root,exist_ok=True)
+        index_path = os.path.join(root,self.INDEX_FILE)
+        meta_path = os.path.join(root,self.META_FILE)
+        faiss.write_index(self.index,index_path + ".tmp")
+        with open(meta_path + ".tmp",'w') as f:
+            json.dump({"situations": self.situations,"texts": self.texts,"pending": self.pending,"ann": self.is_ann},f)
+        os.replace(index_path + ".tmp",index_path)
+        os.replace(meta_path + ".tmp",meta_path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls,root: str,**kwargs):
+        """Memory saved under `root`, or an empty one if nothing was saved yet"""
+        memory = cls(**kwargs)
+        index_path = os.path.join(root,cls.INDEX_FILE)
+        meta_path = os.path.join(root,cls.META_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(meta_path)):
+            return memory
+        import faiss
+        with open(meta_path,'r') as f:
+            meta = json.load(f)
+        if "situations" not in meta:
+            #older saves were keyed by the recommendation text itself, which can't be compared to situations
+            print("INFO: recommendation memory was saved in an older format, starting empty")
+            return memory
+        index = faiss.read_index(index_path)
+        if index.ntotal != len(meta["texts"]):
+            print("WARNING: recommendation memory index and texts disagree, starting empty")
+            return memory
+        memory.index = index
+        memory.situations = meta["situations"]
+        memory.texts = meta["texts"]
+        memory.pending = [tuple(entry) for entry in meta.get("pending",[])]
+        return memory
+
+
+def get_memory(state: dict):
+    """The state's recommendation memory, created empty for a fresh simulation"""
+    memory = state.get("recommendation_memory")
+    if memory is None:
+        memory = RecommendationMemory()
+        state["recommendation_memory"] = memory
+    return memory
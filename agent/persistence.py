@@ -1,57 +1,214 @@
-import os,json
+import os,json,shutil
 
 import pandas as pd
 
-from agent.core import State
+from agent.core import State,OUTPUT_PATH,STORAGE_BACKEND
+from agent.storage import get_backend
+from agent.memory import RecommendationMemory
+from agent.window import RollingWindow,window_data
+from agent.codebook import Codebook,get_codebook
 import datetime
 
+#frames written to every snapshot, window_data is built from the window only when a snapshot is taken
+#tracked rows are a view over the window, only the selection (tracking_hosps) is saved
+FRAME_KEYS = ["window_data","today_data"]
+#number of logged deltas after which the log gets compacted into a new snapshot
+COMPACT_EVERY = 50
 
-def save_state(state: State):   
+
+def record_delta(state: State,op: str,**payload):
+    """Queue a change to be appended to the checkpoint log on the next save_state"""
+    state.setdefault("pending_deltas",[]).append({"op":op,**payload})
+    return state
+
+def _to_builtin(obj):
+    """json fallback for numpy scalars and dates"""
+    if hasattr(obj,"item"):
+        return obj.item()
+    return str(obj)
+
+def _manifest_path():
+    return os.path.join(OUTPUT_PATH,"state.json")
+
+def _snapshot_dir(generation: int):
+    return os.path.join(OUTPUT_PATH,f"snapshot_{generation}")
+
+def _wal_path(generation: int):
+    return os.path.join(OUTPUT_PATH,f"wal_{generation}.jsonl")
+
+def _read_manifest():
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return None
+    with open(path,'r') as f:
+        return json.load(f)
+
+def _state_meta(state: State):
+    return {
+        "sim_date": str(state["sim_date"]),
+        "recommendation":state["recommendation"],
+        "days_since_update": state["days_since_update"],
+        "recommendation_weights": state["recommendation_weights"],
+        "tracking_hosps": list(state["tracking_hosps"]),
+        "resource_names": list(state["resource_names"]),
+        "num_hospitals": state["num_hospitals"],
+        "reports_per_day": state.get("reports_per_day",1),
+        "seed": state.get("seed",42),
+        "stock_scale": state.get("stock_scale",1.0),
+        "recommendation_slate": state.get("recommendation_slate") or [],
+        "recommendation_rejected": bool(state.get("recommendation_rejected")),
+        "recommendation_situation": state.get("recommendation_situation",""),
+    }
+
+def _apply_meta(state: dict,meta: dict):
+    state["sim_date"] = datetime.datetime.fromisoformat(meta["sim_date"])
+    state["days_since_update"] = meta["days_since_update"]
+    state["recommendation_weights"] = meta["recommendation_weights"]
+    state["tracking_hosps"] = set(meta["tracking_hosps"])
+    state["num_hospitals"] = meta["num_hospitals"]
+    state["resource_names"] = meta["resource_names"]
+    state["recommendation"] = meta["recommendation"]
+    state["reports_per_day"] = meta.get("reports_per_day",1)
+    state["seed"] = meta.get("seed",42)
+    state["stock_scale"] = meta.get("stock_scale",1.0)
+    state["recommendation_slate"] = meta.get("recommendation_slate",[])
+    state["recommendation_rejected"] = meta.get("recommendation_rejected",False)
+    state["recommendation_situation"] = meta.get("recommendation_situation","")
+    return state
+
+def _apply_delta(state: dict,delta: dict):
+    """Replay a single logged change on top of a loaded state"""
+    op = delta["op"]
+    if op == "meta":
+        _apply_meta(state,delta)
+    elif op == "transfer":
+        today_df = state["today_data"]
+        col = f"{delta['resource']}_stock"
+        today_df.loc[today_df["hospital"]==delta["from"],col] -= delta["quantity"]
+        today_df.loc[today_df["hospital"]==delta["to"],col] += delta["quantity"]
+    elif op == "append_today":
+        state["window"].append(state["today_data"])
+    elif op == "track":
+        state["tracking_hosps"] = set(delta["hospitals"])
+    else:
+        print(f"WARNING: unknown checkpoint op {op}, skipping")
+    return state
+
+def _write_snapshot(state: State,meta: dict,generation: int):
+    """Write every frame into a fresh snapshot dir, then switch state.json over to it"""
+    snap_dir = _snapshot_dir(generation)
+    shutil.rmtree(snap_dir,ignore_errors=True)
+    backend = get_backend(STORAGE_BACKEND,snap_dir)
+    frames = {"window_data": window_data(state),"today_data": state["today_data"]}
+    for key in FRAME_KEYS:
+        backend.write_frame(key,frames[key])
+    backend.write_frame("distances",state["distances"],index=True)
+    get_codebook(state).save(snap_dir)
+    open(_wal_path(generation),'w').close()
+
+    #state.json is replaced atomically so a crash leaves either the old or the new snapshot
+    manifest = {**meta,"storage": backend.name,"generation": generation}
+    tmp_path = _manifest_path() + ".tmp"
+    with open(tmp_path,'w') as f:
+        json.dump(manifest,f,indent=4,default=_to_builtin)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path,_manifest_path())
+
+    if generation > 0:
+        shutil.rmtree(_snapshot_dir(generation-1),ignore_errors=True)
+        if os.path.exists(_wal_path(generation-1)):
+            os.remove(_wal_path(generation-1))
+
+def _append_wal(generation: int,deltas: list):
+    with open(_wal_path(generation),'a') as f:
+        for delta in deltas:
+            f.write(json.dumps(delta,default=_to_builtin) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _read_wal(generation: int):
+    path = _wal_path(generation)
+    deltas = []
+    if not os.path.exists(path):
+        return deltas
+    with open(path,'r') as f:
+        for line in f:
+            try:
+                deltas.append(json.loads(line))
+            except json.JSONDecodeError:
+                #a torn last line from a crash mid-append, everything before it is intact
+                print("WARNING: checkpoint log ends with a partial record, ignoring it")
+                break
+    return deltas
+
+
+def save_state(state: State):
     """Save current state to disk so that we dont get recursion errors"""
-    path = "./sim_outputs/state.json"
     try:
-        os.makedirs(os.path.dirname(path),exist_ok=True)
-
-        with open(path,'w') as f:
-            json.dump({
-                "sim_date": str(state["sim_date"]),
-                "recommendation":state["recommendation"],
-                "days_since_update": state["days_since_update"],
-                "recommendation_weights": state["recommendation_weights"],
-                "tracking_hosps": list(state["tracking_hosps"]),
-                "resource_names": list(state["resource_names"]),
-                "num_hospitals": state["num_hospitals"]
-            },f,indent=4)
-        state["window_data"].to_csv("./sim_outputs/window_data.csv", index=False)
-        state["today_data"].to_csv("./sim_outputs/today_data.csv", index=False)
-        state["tracking_data"].to_csv("./sim_outputs/tracking_data.csv",index=False)
-        state["distances"].to_csv("./sim_outputs/distances.csv",index=False)
+        os.makedirs(OUTPUT_PATH,exist_ok=True)
+        pending = state.get("pending_deltas") or []
+        meta = _state_meta(state)
+        saved = _read_manifest()
+
+        needs_snapshot = (
+            saved is None
+            or "generation" not in saved
+            or any(delta["op"]=="snapshot" for delta in pending)
+            or state.get("wal_records",0) + len(pending) + 1 > COMPACT_EVERY
+        )
+        if needs_snapshot:
+            generation = saved.get("generation",-1) + 1 if saved else 0
+            _write_snapshot(state,meta,generation)
+            state["wal_records"] = 0
+        else:
+            deltas = pending + [{"op":"meta",**meta}]
+            _append_wal(saved["generation"],deltas)
+            state["wal_records"] = state.get("wal_records",0) + len(deltas)
+        state["pending_deltas"] = []
+
+        memory = state.get("recommendation_memory")
+        if memory is not None:
+            memory.save(OUTPUT_PATH)
     except Exception as e:
         print(f"ERROR: during writing state to disk {str(e)}")
         state = None
     return state
 
 def load_state():
-    path = "./sim_outputs/state.json"
     try:
-        with open(path,'r') as f:
-            saved = json.load(f)
+        saved = _read_manifest()
+        if "generation" in saved:
+            root = _snapshot_dir(saved["generation"])
+        else:
+            #older saves kept the frames next to state.json with no log
+            root = OUTPUT_PATH
+        #older saves don't record a backend and were always csv
+        backend = get_backend(saved.get("storage","csv"),root)
+        distances = backend.read_frame("distances")
+        if isinstance(distances.index,pd.RangeIndex):
+            #older csv saves dropped the index, the matrix is square so rebuild it from the columns
+            distances.index = distances.columns
         state = {
-        "sim_date": datetime.datetime.fromisoformat(saved["sim_date"]),
-        "days_since_update": saved["days_since_update"],
-        "recommendation_weights": saved["recommendation_weights"],
-        "tracking_hosps": set(saved["tracking_hosps"]),
-        "window_data": pd.read_csv("./sim_outputs/window_data.csv",parse_dates=["date"]),
-        "today_data": pd.read_csv("./sim_outputs/today_data.csv",parse_dates=["date"]),
-        "tracking_data":pd.read_csv("./sim_outputs/tracking_data.csv",parse_dates=["date"]),
-        "distances":pd.read_csv("./sim_outputs/distances.csv"),
-        "num_hospitals":saved["num_hospitals"],
-        "resource_names":saved["resource_names"],
-        "recommendation": saved["recommendation"],
+        "distances":distances,
         "done": False,
+        "pending_deltas": [],
     }
+        _apply_meta(state,saved)
+        frames = {key: backend.read_frame(key) for key in FRAME_KEYS}
+        #older saves have no codebook, codes are then assigned in the order of the saved window
+        codebook = Codebook.load(root) or Codebook.from_frame(frames["window_data"],state["resource_names"])
+        state["codebook"] = codebook
+        state["today_data"] = codebook.categorize(frames["today_data"])
+        state["window"] = RollingWindow.from_frame(frames["window_data"],codebook)
+
+        deltas = _read_wal(saved["generation"]) if "generation" in saved else []
+        for delta in deltas:
+            _apply_delta(state,delta)
+        state["wal_records"] = len(deltas)
+        state["recommendation_memory"] = RecommendationMemory.load(OUTPUT_PATH)
     except Exception as e:
         print(f"ERROR: during loading state from disc {str(e)}")
         state = None
-    
-    return state
\ No newline at end of file
+
+    return state
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from agent.core import OUTPUT_PATH
+from agent.utils import get_model,EMBEDDING_MODEL
+
+CONCEPTS = {
+    "cost": "concerns about expenses, distance, or transportation costs",
+    "coverage": "ensuring enough resources are available across all hospitals or regions",
+    "fairness": "equal distribution, fairness, or resource equity among hospitals",
+    "urgency": "emergency, immediate need, or life-critical situations"
+}
+
+
+class PreferenceAttributor:
+    """Attributes a rejection to the recommendation weights by semantic similarity to fixed concepts.
+
+    Concept embeddings are encoded once and cached on disk next to the saved state, the feedback and
+    justification are encoded in a single batch and scored against all concepts with one matrix product.
+    """
+
+    def __init__(self,model = None,concepts: dict = CONCEPTS,cache_path: str = None,
+                 feedback_weight: float = 0.4,justification_weight: float = 0.6,
+                 floor: float = 0.08,span: float = 0.6,delta_max: float = 0.1):
+        self._model = model
+        self.concepts = concepts
+        self.cache_path = cache_path
+        self.text_weights = np.array([feedback_weight,justification_weight])
+        self.floor = floor
+        self.span = span
+        self.delta_max = delta_max
+        self._concept_matrix = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_model()
+        return self._model
+
+    def _load_cached(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        cached = np.load(self.cache_path,allow_pickle=False)
+        #only reuse embeddings of the exact same concept texts and model
+        if list(cached["texts"]) != list(self.concepts.values()) or str(cached["model"]) != EMBEDDING_MODEL:
+            return None
+        return cached["embeddings"]
+
+    @property
+    def concept_matrix(self):
+        """(concepts, dims) matrix of normalized concept embeddings"""
+        if self._concept_matrix is None:
+            matrix = self._load_cached()
+            if matrix is None:
+                matrix = self.model.encode(list(self.concepts.values()),normalize_embeddings=True)
+                if self.cache_path:
+                    os.makedirs(os.path.dirname(self.cache_path) or ".",exist_ok=True)
+                    np.savez(self.cache_path,embeddings=matrix,texts=np.array(list(self.concepts.values())),model=np.array(EMBEDDING_MODEL))
+            self._concept_matrix = np.asarray(matrix)
+        return self._concept_matrix
+
+    def similarities(self,feedback: str,justification: str):
+        """(2, concepts) cosine similarities of the feedback and the justification to every concept"""
+        texts = self.model.encode([feedback or "",justification or ""],normalize_embeddings=True)
+        return np.asarray(texts) @ self.concept_matrix.T
+
+    def offsets(self,feedback: str,justification: str):
+        """How much each weight should drop for this rejection"""
+        sims = self.text_weights @ self.similarities(feedback,justification)
+        offsets = (np.maximum(sims,self.floor) - self.floor) / self.span * self.delta_max
+        return {concept: float(offset) for concept,offset in zip(self.concepts,offsets)}
+
+
+_attributor = None
+
+def get_attributor():
+    """Process wide attributor, so concept embeddings are only ever computed once"""
+    global _attributor
+    if _attributor is None:
+        _attributor = PreferenceAttributor(cache_path=os.path.join(OUTPUT_PATH,"concept_embeddings.npz"))
+    return _attributor
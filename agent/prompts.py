@@ -0,0 +1,138 @@
+import functools
+
+#rough chars per token for english prose and short identifiers, close enough for budgeting
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+@functools.lru_cache(maxsize=None)
+def recommendation_prefix(slate_size: int):
+    """Instructions shared by every recommendation call, nothing in here changes between calls so the
+    prefix can be reused by server side prompt caching"""
+    return f"""You are a healthcare resource allocation assistant tasked with optimizing resource distribution across hospitals.
+
+Your job: decide how to reallocate resources between hospitals based on forecasted shortages or surpluses.
+
+**Your task:**
+1. Look at the candidate transfers below, they move surplus stock to hospitals forecast to run short.
+2. Suggest **specific transfers** between the allowed hospitals in plain text.
+3. Justify each recommendation using the 4 preference weights.
+
+**Rules:**
+1.Only give response in valid JSON format.
+2.Give {slate_size} alternative recommendations ordered from best to worst, each a different transfer.
+3.Do not include additional text, abbreviations or salutations.
+4.Do not show weights in your justification.
+5.**You must only reference hospitals from the allowed hospitals list.**
+6.**Never mention or invent hospitals that are not in the list.**
+7.NEVER recommend transfer to the same hospital.
+8.Round quantities to INTEGERS.
+9.If there are no actionable imbalances between the allowed hospitals, clearly state that in the recommendation and justification fields.
+10.**Each recommendation must contain only ONE transfer.**
+11.**The "meta" field MUST be a single object, NOT a list or array.**
+12. GIVE REALISTIC QUANTITIES, NEVER RECOMMEND TO NUMBERS MORE THAN OR EQUAL TO THE ENTIRE SURPLUS STOCK
+13.DO NOT give the same recommendation as the previous or the past ones.
+14.**You must choose the resource name exactly as written in the allowed resources list, the casing must match exactly.**
+15.The JSON must exactly match this structure (no extra keys):
+
+**JSON Format:**
+{{
+  "recommendations": [
+    {{
+      "recommendation": "<short plain sentence describing ONE transfer>",
+      "justification": "<reasoning in 2 to 3 sentences>",
+      "meta": {{
+          "from": "[<hospital name>]",
+          "to": "<hospital name>",
+          "resource": "<resource name>",
+          "quantity": <integer>
+      }}
+    }}
+  ]
+}}
+
+Candidate transfers are listed one per line as
+providers -> receiving hospital | resource | shortage | avg distance km | receiving stock
+where each provider is written as hospital:units offered/current stock.
+"""
+
+
+def candidate_line(cand: dict):
+    """One compact table row for a summarized candidate"""
+    providers = ", ".join(f"{hosp}:{int(qty)}/{int(stock)}" for hosp,qty,stock in cand["providers"])
+    return (f"{providers} -> {cand['short_hospital']} | {cand['resource']} | {int(cand['shortage'])} | "
+            f"{cand['avg_dist']} | {int(cand['short_stock'])}")
+
+
+def build_recommendation_prompt(candidates: list,priorities: dict,previous: str,feedback: str,past: list,
+                                resources: list,slate_size: int,budget: int):
+    """Static prefix plus as much of the current situation as fits in `budget` tokens.
+
+    Candidates are added best first and similar past recommendations only if there is room left. Only
+    hospitals and resources that appear in the included candidates are listed as allowed. Returns the
+    prompt and stats about what went in.
+    """
+    prefix = recommendation_prefix(slate_size)
+    head = "\n".join([
+        "Current preference weights (higher = more preferred):",
+        *(f"- {name}: {priorities.get(key,'MEDIUM')}" for key,name in
+          (("cost","Cost Efficiency"),("coverage","Coverage"),("fairness","Fairness"),("urgency","Urgency"))),
+        "",
+        f"Previous recommendation: {previous or 'None'}",
+        f"User feedback on it: {feedback or 'None'}",
+    ])
+    #section headers and the resource list are there whatever gets included
+    scaffold = ("\n\nCandidate transfers:\n\nPast recommendations for similar situations:\n\n"
+                f"Allowed hospitals: []\nAllowed resources: {list(resources)}")
+    used = estimate_tokens(prefix) + estimate_tokens(head) + estimate_tokens(scaffold)
+
+    lines = []
+    hospitals = set()
+    used_resources = []
+    for cand in candidates:
+        line = candidate_line(cand)
+        new_hospitals = {cand["short_hospital"],*(hosp for hosp,_,_ in cand["providers"])} - hospitals
+        #the allowed lists grow with every included candidate, count them against the budget too
+        cost = estimate_tokens(line) + estimate_tokens(", ".join(new_hospitals)) + 1
+        if lines and used + cost > budget:
+            break
+        lines.append(line)
+        hospitals |= new_hospitals
+        if cand["resource"] not in used_resources:
+            used_resources.append(cand["resource"])
+        used += cost
+
+    past_lines = []
+    for text in past:
+        cost = estimate_tokens(text) + 1
+        if used + cost > budget:
+            break
+        past_lines.append(f"- {text}")
+        used += cost
+
+    body = "\n".join([
+        head,
+        "",
+        "Candidate transfers:",
+        *(lines or ["None"]),
+        "",
+        "Past recommendations for similar situations:",
+        *(past_lines or ["None"]),
+        "",
+        f"Allowed hospitals: {sorted(hospitals) if hospitals else 'None'}",
+        f"Allowed resources: {used_resources or list(resources)}",
+    ])
+    prompt = prefix + "\n" + body
+    stats = {
+        "tokens_est": estimate_tokens(prompt),
+        "prefix_tokens_est": estimate_tokens(prefix),
+        "budget": budget,
+        "candidates": len(lines),
+        "candidates_dropped": len(candidates) - len(lines),
+        "past_included": len(past_lines),
+        "hospitals": len(hospitals),
+    }
+    return prompt,stats
@@ -1,11 +1,16 @@
-from agent.core import State,llm_client,MODEL_NAME
-from agent.utils import parse_model_res,index,model
-from agent.forecasting import prepare_candidates
+from agent.core import State,llm_client,MODEL_NAME,PROMPT_TOKEN_BUDGET
+from agent.utils import parse_model_res,parse_partial,stream_writer
+from agent.preferences import get_attributor
+from agent.memory import get_memory
+from agent.forecasting import prepare_candidates,SEVERITY_SCORE
+from agent.persistence import record_delta
+from agent.distance_index import get_distance_index
+from agent.window import get_window
+from agent.codebook import get_codebook
+from agent.prompts import build_recommendation_prompt
+from agent.validation import validate_recommendation
 
 
-from sklearn.metrics.pairwise import cosine_similarity
-
-import pandas as pd
 import numpy as np
 import datetime
 
@@ -20,45 +25,70 @@ def apply_offsets(weights,offsets,alpha=0.8):
     return weights
 
 
-def rank_candidates(state: State):
-    """From all transfers get top 3 potential transfers"""
+#number of ranked candidates handed to the model
+TOP_K = 3
+#alternatives asked for in one model call, later requests after a rejection are served from them
+SLATE_SIZE = 3
+
+def candidate_arrays(candidates: list,dist_index):
+    """Shortage, available surplus, mean and max provider distance of every candidate as flat arrays"""
+    n_providers = np.array([len(cand["providers"]) for cand in candidates],dtype=int)
+    shortage = np.array([cand["shortage"] for cand in candidates],dtype=float)
+    short_codes = np.repeat(dist_index.encode([cand["short_hospital"] for cand in candidates]),n_providers)
+    provider_codes = dist_index.encode([p["hospital"] for cand in candidates for p in cand["providers"]])
+    quantities = np.array([p["quantity"] for cand in candidates for p in cand["providers"]],dtype=float)
+
+    owner = np.repeat(np.arange(len(candidates)),n_providers)
+    distances = dist_index.matrix[short_codes,provider_codes]
+    available = np.bincount(owner,weights=quantities,minlength=len(candidates))
+    with np.errstate(invalid="ignore",divide="ignore"):
+        avg_dist = np.bincount(owner,weights=distances,minlength=len(candidates)) / n_providers
+    max_dist = np.ones(len(candidates))
+    has_providers = n_providers > 0
+    if has_providers.any():
+        starts = np.concatenate(([0],np.cumsum(n_providers)[:-1]))[has_providers]
+        max_dist[has_providers] = np.maximum.reduceat(distances,starts)
+    return shortage,available,avg_dist,max_dist
+
+def score_candidates(candidates: list,weights: dict,severity: str,dist_index):
+    """Weighted cost, coverage, fairness and urgency score of every candidate in one pass"""
+    shortage,available,avg_dist,max_dist = candidate_arrays(candidates,dist_index)
+    with np.errstate(invalid="ignore",divide="ignore"):
+        coverage_score = weights["coverage"]*(np.minimum(shortage,available)/shortage)
+        fairness_score = weights["fairness"]*(1 - np.abs(available - shortage)/(available+shortage))
+        distance_score = weights["cost"]*(1 - avg_dist/max_dist)
+    urgency_score = weights["urgency"]*SEVERITY_SCORE[severity]
+    scores = distance_score + coverage_score + fairness_score + urgency_score
+    #candidates without providers (no distance to score) rank last
+    return np.where(np.isnan(scores),-np.inf,scores)
+
+def top_k_indices(scores: np.ndarray,k: int):
+    """Indices of the k best scores, best first, earlier candidates win ties"""
+    if k <= 0 or not len(scores):
+        return np.array([],dtype=int)
+    if len(scores) > k:
+        kth = scores[np.argpartition(-scores,k-1)[:k]].min()
+        pool = np.nonzero(scores >= kth)[0]
+    else:
+        pool = np.arange(len(scores))
+    return pool[np.lexsort((pool,-scores[pool]))][:k]
+
+def rank_candidates(state: State,top_k: int = TOP_K,candidates: list = None):
+    """From all transfers get the top_k potential transfers"""
     try:
-        candidates = prepare_candidates(state)
+        if candidates is None:
+            candidates = prepare_candidates(state)
         print("INFO: Ranking Candidates")
-        if candidates==[]:
+        if not candidates:
             return []
-        w_cost = state["recommendation_weights"]["cost"]
-        w_coverage = state["recommendation_weights"]["coverage"]
-        w_fairness = state["recommendation_weights"]["fairness"]
-        w_urgency = state["recommendation_weights"]["urgency"]
-        
-        for candidate in candidates:
-            short_hosp = candidate["short_hospital"]
-            providers = candidate["providers"]
-            shortage = candidate["shortage"]
-            available_surplus = 0
-            for provider in providers:
-                available_surplus += provider["quantity"] 
-            coverage_score = w_coverage*(min(shortage,available_surplus)/shortage)
-            fairness_score = w_fairness*(1 - abs(available_surplus - shortage)/(available_surplus+shortage))
-            severity_score = {"mild":1.05,"moderate":1.2,"severe":1.4,"critical":1.6}
-            urgency_score = w_urgency*(severity_score[state["report_data"]["severity"]])
-            distances = [state["distances"].loc[short_hosp,p["hospital"]] for p in providers]
-            avg_dist = np.mean(distances)
-
-            distances = [state["distances"].loc[short_hosp, p["hospital"]] for p in providers]
-            avg_dist = np.mean(distances)
-            max_dist = max(distances) if distances else 1
-            distance_score = w_cost * (1 - (avg_dist / max_dist))
-
-
-            score = distance_score + coverage_score + fairness_score + urgency_score
-            candidate["score"] = score
-
-        candidates.sort(key= lambda x: x["score"],reverse=True)
-
-        top_k = candidates[:min(3,len(candidates))]
-        return top_k
+        scores = score_candidates(candidates,state["recommendation_weights"],state["report_data"]["severity"],get_distance_index(state))
+
+        ranked = []
+        for idx in top_k_indices(scores,top_k):
+            candidate = candidates[idx]
+            candidate["score"] = float(scores[idx])
+            ranked.append(candidate)
+        return ranked
     except Exception as e:
         print(f"ERROR: during ranking candidates: {str(e)}")
 
@@ -80,114 +110,65 @@ def decide_preferences(state:State):
         prefs[key] = priority
     
     return priority
+def situation_summary(summaries: list):
+    """Plain text description of the imbalances behind a recommendation, what the memory is keyed on"""
+    return "\n".join(
+        f"{summary['resource']} short by {int(summary['shortage'])} at {summary['short_hospital']}, "
+        f"surplus at {', '.join(hosp for hosp,_,_ in summary['providers'])}"
+        for summary in summaries
+    )
+
 def llm_recommendation(state:State):
     print("INFO: LLM Recommendation started")
     try:
-        ranked_candidates = rank_candidates(state)
+        ranked_candidates = rank_candidates(state,top_k=max(TOP_K,SLATE_SIZE))
         priorities = decide_preferences(state)
-        summary_lines = []
+        dist_index = get_distance_index(state)
+        codebook = get_codebook(state)
+        #today's stock as a (hospital, resource) array, looked up by code instead of filtering rows
+        today_stock = codebook.resource_matrix(state["today_data"],"stock")
+        summaries = []
         for cand in ranked_candidates:
             short_hosp = cand["short_hospital"]
             resource = cand["resource"]
-            shortage = cand["shortage"]
-            providers = cand["providers"]
-            shortage_stock = state["today_data"].loc[state["today_data"]["hospital"]==short_hosp,f"{resource}_stock"]
-            provider_strs = []
-            distances = []
-            for p in providers:
-                from_hos = p["hospital"]
-                qty = p["quantity"]
-                dist = state["distances"].loc[short_hosp, from_hos]
-                stock = state["today_data"].loc[state["today_data"]["hospital"]==from_hos,f"{resource}_stock"].values[0]
-                distances.append(dist)
-                provider_strs.append(f"{from_hos} ({int(qty)} units) (current stock(surplus hospital):{int(stock)})")
-
-            avg_dist = round(np.mean(distances), 1)
-            summary_lines.append(
-                f"{', '.join(provider_strs)} -> {short_hosp} | {resource} | "
-                f"shortage: {int(shortage)} | avg distance: {avg_dist} km | shortage stock: {int(shortage_stock)}"
-            )
-
-        ranked_summary = "\n".join(summary_lines)
-
-        if isinstance(priorities,dict):
-            w_cost = priorities.get("cost")
-            w_coverage  = priorities.get("coverage")
-            w_fairness = priorities.get("fairness")
-            w_urgency= priorities.get("urgency")
-        else:
-            w_cost = "MEDIUM"
-            w_coverage  = "MEDIUM"
-            w_fairness = "MEDIUM"
-            w_urgency= "MEDIUM"
-
-        recommendation = state.get("recommendation","")
-        feedback = state.get("user_feedback","")
-        tracked_hospitals = list(state["tracking_hosps"])  
-        resource_names = state.get("resource_names",[])
-
-        llm_prompt = f"""
-    You are a healthcare resource allocation assistant tasked with optimizing resource distribution across hospitals.
-
-    Your job: decide how to reallocate resources between hospitals based on forecasted shortages or surpluses.
-
-    Current preference weights (higher = more preferred):
-    - Cost Efficiency: {w_cost}
-    - Coverage: {w_coverage}
-    - Fairness: {w_fairness}
-    - Urgency: {w_urgency}
-
-    Here are selected candidate utilizations:
-    {ranked_summary}
-
-    This is the previous given recommendation:
-    {recommendation}
-
-    And this is the user feedback for that recommendation:
-    {feedback}
-
-    DO NOT give the same recommendation again.
-
-    **Important:** You must choose the resource name exactly as provided in this list: {resource_names}.
-    Do not invent or modify any resource names. The casing must match exactly.
-
-    ---
-
-    **Your task:**
-    1. Identify hospitals facing *shortages* (high forecast values) and *surpluses* (low forecast values) **only among the tracked hospitals**.
-    2. Suggest **specific transfers** between tracked hospitals in plain text. 
-    3. Justify each recommendation using the 4 preference weights.
-
-    **Rules:**
-    1.Only give response in valid JSON format.
-    2.Give only a single recommendation.
-    3.Do not include additional text, abbreviations or salutations.
-    4.Do not show weights in your justification.
-    5.**You must only reference hospitals from this list: {tracked_hospitals}.**
-    6.**Never mention or invent hospitals that are not in the list.**
-    7.NEVER recommend transfer to the same hospital.
-    8.Round quantities to INTEGERS.
-    9.If there are no actionable imbalances between the tracked hospitals, clearly state that in the recommendation and justification fields.
-    10.**Do NOT provide multiple transfers or a list of transfers. Only ONE transfer should be included.**
-    11.**The "meta" field MUST be a single object, NOT a list or array.**
-    12. GIVE REALISTIC QUANTITIES, NEVER RECOMMEND TO NUMBERS MORE THAN OR EQUAL TO THE ENTIRE SURPLUS STOCK
-    13.The JSON must exactly match this structure (no extra keys):
-
-    **JSON Format:**
-    {{
-      "recommendation": "<short plain sentence describing ONE transfer>",
-      "justification": "<reasoning in 2 to 3 sentences>",
-      "meta": {{
-          "from": "[<hospital name>]",
-          "to": "<hospital name>",
-          "resource": "<resource name>",
-          "quantity": <integer>
-      }}
-    }}
-    """
-        
-        res = llm_client.models.generate_content(model=MODEL_NAME,contents=llm_prompt)
-        res_dict = parse_model_res(res.text)
+            res_code = codebook.resource_codes[resource]
+            providers = [(p["hospital"],p["quantity"],today_stock[codebook.hospital_codes[p["hospital"]],res_code]) for p in cand["providers"]]
+            distances = dist_index.distances(short_hosp,[hosp for hosp,_,_ in providers])
+            summaries.append({
+                "short_hospital": short_hosp,
+                "resource": resource,
+                "shortage": cand["shortage"],
+                "short_stock": today_stock[codebook.hospital_codes[short_hosp],res_code],
+                "avg_dist": round(float(np.mean(distances)),1) if len(distances) else 0.0,
+                "providers": providers,
+            })
+
+        #memory is keyed by the situation, what it returns is what was recommended in similar ones
+        state["recommendation_situation"] = situation_summary(summaries)
+        similar_past = get_memory(state).search(state["recommendation_situation"],k=3)
+
+        llm_prompt,prompt_stats = build_recommendation_prompt(
+            summaries,
+            priorities if isinstance(priorities,dict) else {},
+            previous=state.get("recommendation",""),
+            feedback=state.get("user_feedback",""),
+            past=[text for text,_ in similar_past],
+            resources=state.get("resource_names",[]),
+            slate_size=SLATE_SIZE,
+            budget=PROMPT_TOKEN_BUDGET,
+        )
+        state["prompt_stats"] = prompt_stats
+        print(f"INFO: recommendation prompt ~{prompt_stats['tokens_est']} tokens (budget {PROMPT_TOKEN_BUDGET}), "
+              f"{prompt_stats['candidates']} candidates, {prompt_stats['hospitals']} hospitals")
+
+        #stream the answer so the page can show it while it is being written
+        writer = stream_writer()
+        chunks = []
+        for chunk in llm_client.models.generate_content_stream(model=MODEL_NAME,contents=llm_prompt):
+            if chunk.text:
+                chunks.append(chunk.text)
+                writer({"token": chunk.text})
+        res_dict = parse_model_res("".join(chunks))
         # print(f"INFO:RAW RES DICT \n {res_dict}")
 
     except Exception as e:
@@ -198,11 +179,122 @@ def llm_recommendation(state:State):
     return res_dict
 
 
+def split_slate(res_dict: dict):
+    """Model answer as a list of alternatives, best first, older single recommendation answers become a slate of one"""
+    slate = res_dict.get("recommendations") if isinstance(res_dict,dict) else None
+    if isinstance(slate,list):
+        return [item for item in slate if isinstance(item,dict)] or [{}]
+    return [res_dict if isinstance(res_dict,dict) else {}]
+
+def streamed_recommendation(text: str):
+    """Text of the best alternative as far as it has streamed in"""
+    partial = parse_partial(text)
+    if partial is None:
+        return ""
+    return str(split_slate(partial)[0].get("recommendation") or "")
+
+def validate_slate(slate: list,state: State):
+    """Alternatives of the slate repaired against the tracked hospitals and resources, unsalvageable ones dropped.
+    Quantities are capped at the provider's forecast surplus, or its stock today if it has none"""
+    codebook = get_codebook(state)
+    hospitals = sorted(state.get("tracking_hosps") or []) or codebook.hospitals
+    today_stock = codebook.resource_matrix(state["today_data"],"stock")
+    surplus = {(entry["hospital"],entry["resource"]): entry["quantity"] for entry in state.get("surpluses") or []}
+
+    def available(hosp: str,resource: str):
+        if (hosp,resource) in surplus:
+            return surplus[(hosp,resource)]
+        value = today_stock[codebook.hospital_codes[hosp],codebook.resource_codes[resource]]
+        return None if np.isnan(value) else float(value)
+
+    valid = [validate_recommendation(item,hospitals,codebook.resources,available) for item in slate]
+    valid = [item for item in valid if item is not None]
+    if len(valid) < len(slate):
+        print(f"WARNING: dropped {len(slate)-len(valid)} of {len(slate)} recommendations that could not be repaired")
+    return valid
+
+def slate_candidate(item: dict,shortage_by_key: dict):
+    """A slate alternative in the candidate shape so it can be scored like the matched transfers"""
+    meta = item["meta"]
+    from_hosp = meta.get("from",[])
+    if isinstance(from_hosp,str):
+        from_hosp = [from_hosp]
+    quantity = float(meta.get("quantity") or 0)
+    return {
+        "short_hospital": meta["to"],
+        "resource": meta["resource"],
+        "shortage": shortage_by_key[(meta["to"],meta["resource"])],
+        "providers": [{"hospital":hosp,"quantity":quantity} for hosp in from_hosp],
+    }
+
+def rescore_slate(state: State):
+    """Alternatives left in the slate that still target a current shortage, best first under the current weights"""
+    slate = state.get("recommendation_slate") or []
+    if not slate:
+        return []
+    dist_index = get_distance_index(state)
+    shortage_by_key = {(entry["hospital"],entry["resource"]): entry["quantity"] for entry in state.get("shortages") or []}
+
+    valid = []
+    for item in slate:
+        meta = item.get("meta")
+        if not isinstance(meta,dict) or (meta.get("to"),meta.get("resource")) not in shortage_by_key:
+            continue
+        from_hosp = meta.get("from",[])
+        from_hosp = [from_hosp] if isinstance(from_hosp,str) else from_hosp
+        if not from_hosp or any(hosp not in dist_index.codes for hosp in from_hosp):
+            continue
+        valid.append(item)
+    if not valid:
+        return []
+
+    candidates = [slate_candidate(item,shortage_by_key) for item in valid]
+    scores = score_candidates(candidates,state["recommendation_weights"],state["report_data"]["severity"],dist_index)
+    return [valid[idx] for idx in top_k_indices(scores,len(valid))]
+
+def local_recommendation(state:State):
+    """Recommendation from the top ranked candidate without asking the model, used for offline runs"""
+    ranked_candidates = rank_candidates(state) or []
+    for cand in ranked_candidates:
+        providers = [p for p in cand["providers"] if p["quantity"] >= 1]
+        if not providers:
+            continue
+        provider = providers[0]
+        quantity = int(min(provider["quantity"],cand["shortage"]))
+        short_hosp = cand["short_hospital"]
+        resource = cand["resource"]
+        return {
+            "recommendation": f"Transfer {quantity} units of {resource} from {provider['hospital']} to {short_hosp}",
+            "justification": f"{short_hosp} is forecast to run short of {resource} by {int(cand['shortage'])} units and {provider['hospital']} has surplus to cover it.",
+            "meta": {"from":[provider["hospital"]],"to":short_hosp,"resource":resource,"quantity":quantity}
+        }
+    return {
+        "recommendation": "No actionable imbalances between the tracked hospitals",
+        "justification": "No tracked hospital is forecast to run short of a resource another one can spare.",
+        "meta": None
+    }
+
+
 def build_recommendations(state: State):
     """Based on the current data and forecasts and previous user interactions, build the recommendations"""
     try:
         print("INFO: Building recommendations")
-        res_dict = llm_recommendation(state)
+        if state.get("offline"):
+            res_dict = local_recommendation(state)
+        else:
+            #the slate only answers a rejection, any other request gets a fresh model answer
+            slate = rescore_slate(state) if state.get("recommendation_rejected") else []
+            state["recommendation_rejected"] = False
+            if slate:
+                print(f"INFO: serving recommendation from the slate, {len(slate)-1} alternatives left")
+            else:
+                slate = validate_slate(split_slate(llm_recommendation(state)),state)
+                if not slate:
+                    #nothing usable came back, the best ranked transfer beats asking again
+                    print("WARNING: no usable recommendation from the model, using the top ranked candidate")
+                    slate = [local_recommendation(state)]
+            res_dict = slate[0]
+            state["recommendation_slate"] = slate[1:]
         # print("INFO:", type(res_dict), res_dict)
 
         today_df = state["today_data"]
@@ -243,6 +335,8 @@ def build_recommendations(state: State):
         state["recommendation"] = res_dict.get("recommendation", "")
         state["recommendation_justification"] = res_dict.get("justification", "")
         state["recommendation_meta"] = res_meta
+        if not state.get("offline"):
+            get_memory(state).add(state.get("recommendation_situation",""),state["recommendation"])
 
     except Exception as e:
         print(f"ERROR: during recommending things {str(e)}")
@@ -251,6 +345,19 @@ def build_recommendations(state: State):
     return state
 
 
+def advance_day(state: State):
+    """Move the simulation to the next day.
+
+    Only an approval or an explicit next day does this, a rejection stays on the same day so asking
+    again reuses the day's reports, forecasts and conclusions and only the recommendation is redone.
+    A rejection left unanswered doesn't carry over, the new day's first request asks the model.
+    """
+    print(f"INFO: days since last update(feedback): {state["days_since_update"]}")
+    state["sim_date"] += datetime.timedelta(days=1)
+    state["days_since_update"]+=1
+    state["recommendation_rejected"] = False
+    return state
+
 def get_feedback(state: State,approval:bool,transfer_vals:dict = {},reason:str = ""):
     """Adjusts weights based on feedback"""
 
@@ -260,6 +367,8 @@ def get_feedback(state: State,approval:bool,transfer_vals:dict = {},reason:str =
         if approval:
             for weight in state["recommendation_weights"].keys():
                 state["recommendation_weights"][weight] += 0.02
+            #the alternatives were planned against stocks this transfer changes
+            state["recommendation_slate"] = []
             meta = state.get("recommendation_meta")
             if isinstance(meta,dict) and meta.get("resource"):
                 resource = meta.get("resource","")
@@ -272,44 +381,23 @@ def get_feedback(state: State,approval:bool,transfer_vals:dict = {},reason:str =
 
                     today_df.loc[today_df["hospital"]== fh,f"{resource}_stock"] -= qty
                     today_df.loc[today_df["hospital"]==to_hos,f"{resource}_stock"] += qty
+                    record_delta(state,"transfer",resource=resource,quantity=qty,**{"from":fh,"to":to_hos})
 
-                state["tracking_data"] = pd.concat([state["tracking_data"],today_df])
-                recent_dates = sorted(state["tracking_data"]["date"].unique())[-14:]
-                state["tracking_data"] = state["tracking_data"][state["tracking_data"]["date"].isin(recent_dates)]
+                get_window(state).append(today_df)
+                record_delta(state,"append_today")
 
                 state["today_data"] = today_df
+            advance_day(state)
         else:
-            concepts = {
-            "cost": "concerns about expenses, distance, or transportation costs",
-            "coverage": "ensuring enough resources are available across all hospitals or regions",
-            "fairness": "equal distribution, fairness, or resource equity among hospitals",
-            "urgency": "emergency, immediate need, or life-critical situations"
-            }
-
-            concept_embs = {k: model.encode(v,normalize_embeddings=True) for k,v in concepts.items()}
-            feedback_emb = model.encode(reason,normalize_embeddings=True).reshape(1,-1)
-            justification_emb = model.encode(state["recommendation_justification"],normalize_embeddings=True).reshape(1,-1)
-
-
-            delta_max = 0.1
-            for concept,emb in concept_embs.items():
-                feedback_sim = cosine_similarity(feedback_emb,emb.reshape(1,-1))[0][0]
-                justification_sim = cosine_similarity(justification_emb, emb.reshape(1,-1))[0][0]
-                print(f"INFO: feedback_sim: {feedback_sim}, justification_sim:{justification_sim}")
-                sim = 0.4*feedback_sim + 0.6*justification_sim
-                print(f"INFO: overall sim: {sim}")
-
-                offset = 0
-                offset = (max(sim,0.08) - 0.08)/(0.6)*delta_max
-                print(f"INFO: offset: {offset}")
-                state["recommendation_weights"][concept] -= float(offset)
+            state["recommendation_rejected"] = True
+            offsets = get_attributor().offsets(reason,state.get("recommendation_justification"))
+            for concept,offset in offsets.items():
+                print(f"INFO: {concept} offset: {offset}")
+                state["recommendation_weights"][concept] -= offset
 
 
         print(f"After update: {state["recommendation_weights"]}")
-        print(f"INFO: days since last update(feedback): {state["days_since_update"]}")
-        state["sim_date"] += datetime.timedelta(days=1)
-        state["days_since_update"]+=1
-        print(state["tracking_data"]["hospital"].unique())
+        print(sorted(state["tracking_hosps"]))
 
     except Exception as e:
         print(f"ERROR: during feedback func {str(e)}")
@@ -0,0 +1,43 @@
+"""Command line scaffolding shared by the pipeline benchmark and the headless simulation."""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import contextlib
+
+#the genai client is created at import time, runners never call it but it needs a key to exist
+os.environ.setdefault("GEMINI_API_KEY","offline-runner")
+
+
+def runner_parser(doc: str):
+    """Argument parser with the module docstring as help and the options every runner takes"""
+    parser = argparse.ArgumentParser(description=doc,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock-scale",type=float,default=0.5,help="multiply generated stocks by this to create shortages")
+    parser.add_argument("--output",help="write results here instead of stdout")
+    return parser
+
+@contextlib.contextmanager
+def scratch_dir(prefix: str):
+    """Run in a temporary working directory that is removed afterwards, the previous one is restored"""
+    cwd = os.getcwd()
+    #the pipeline reads and writes sim_data/ and sim_outputs/ relative to the working directory
+    with tempfile.TemporaryDirectory(prefix=prefix) as workdir:
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(cwd)
+
+def logs_to_stderr():
+    #node logging goes to stderr so stdout stays valid json
+    return contextlib.redirect_stdout(sys.stderr)
+
+def write_report(report: dict,output: str = None):
+    """Results as json to `output`, or to stdout if there is none"""
+    if output:
+        with open(output,'w') as f:
+            json.dump(report,f,indent=2)
+        print(f"INFO: results written to {output}",file=sys.stderr)
+    else:
+        print(json.dumps(report,indent=2))
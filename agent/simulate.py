@@ -0,0 +1,166 @@
+"""Headless multi-day simulation runner.
+
+Runs the recommendation graph day after day without the UI, answering every recommendation with a
+scripted feedback policy, for a grid of seeds, fleet sizes, policies and starting weights. Scenarios
+are independent so they are spread over a process pool, each in its own working directory. Reports
+are extracted and recommendations made without the model, so runs are reproducible and free.
+
+    python -m agent.simulate --days 30 --seeds 1 2 3 --hospitals 5 20 --policies accept random --stock-scale 0.5 --workers 4
+"""
+import os
+import sys
+import time
+import random
+import itertools
+from concurrent.futures import ProcessPoolExecutor,as_completed
+
+import numpy as np
+
+from agent.runner import runner_parser,scratch_dir,logs_to_stderr,write_report
+
+DEFAULT_RESOURCES = ["oxygen","ventilators","medication_TB","ppe_kits"]
+WEIGHT_SETS = {
+    "balanced": {"cost":0.5,"coverage":0.5,"fairness":0.5,"urgency":0.5},
+    "cost": {"cost":0.8,"coverage":0.4,"fairness":0.4,"urgency":0.4},
+    "urgency": {"cost":0.4,"coverage":0.5,"fairness":0.4,"urgency":0.8},
+}
+REJECTION_REASONS = [
+    "The provider is too far away, transport would cost too much",
+    "This does not cover the shortage across the region",
+    "The distribution is unfair to the providing hospital",
+    "This is not urgent enough to move stock now",
+]
+
+
+def accept_policy(state,rng):
+    return True,""
+
+def reject_policy(state,rng):
+    return False,REJECTION_REASONS[rng.randrange(len(REJECTION_REASONS))]
+
+def random_policy(state,rng):
+    if rng.random() < 0.5:
+        return accept_policy(state,rng)
+    return reject_policy(state,rng)
+
+#a policy decides (approval, reason) for the day's recommendation
+POLICIES = {"accept":accept_policy,"reject":reject_policy,"random":random_policy}
+
+
+def run_scenario(scenario: dict):
+    """Simulate one scenario for `days` days in a scratch working directory and return its metrics"""
+    with scratch_dir("medical_agent_sim_"):
+        return simulate_days(scenario)
+
+def simulate_days(scenario: dict):
+    """Run the graph day after day, answering each recommendation with the scenario's policy"""
+    from agent.graph import build_graph,new_state
+    from agent.recommendations import get_feedback,advance_day
+
+    #memo caches left by an earlier scenario would skip this one's report draws, each gets its own graph
+    graph = build_graph(persist=False,instrument=False)
+    policy = POLICIES[scenario["policy"]]
+    rng = random.Random(scenario["seed"])
+
+    state = new_state(
+        seed=scenario["seed"],
+        offline=True,
+        num_hospitals=scenario["hospitals"],
+        resource_names=list(scenario["resources"]),
+        reports_per_day=scenario["reports_per_day"],
+        stock_scale=scenario["stock_scale"],
+        recommendation_weights=dict(WEIGHT_SETS[scenario["weights"]]),
+    )
+
+    shortages,shortage_units = [],[]
+    accepted,rejected,idle,units_moved = 0,0,0,0
+    start = time.perf_counter()
+    for _ in range(scenario["days"]):
+        state = graph.invoke(state)
+        shortages.append(len(state.get("shortages") or []))
+        shortage_units.append(float(sum(s["quantity"] for s in state.get("shortages") or [])))
+
+        meta = state.get("recommendation_meta")
+        if not isinstance(meta,dict) or not meta:
+            #nothing to transfer, there is no recommendation to give feedback on
+            idle += 1
+            state = advance_day(state)
+        else:
+            approval,reason = policy(state,rng)
+            if approval:
+                accepted += 1
+                units_moved += int(meta.get("quantity",0))*len(meta.get("from",[]))
+            else:
+                rejected += 1
+            state = get_feedback(state,approval=approval,transfer_vals={},reason=reason)
+            if not approval:
+                #a rejection stays on the same day, the scenario still moves on
+                state = advance_day(state)
+        #nothing is persisted, so the checkpoint log is never drained
+        state["pending_deltas"] = []
+
+    return {
+        **scenario,
+        "wall_s": round(time.perf_counter() - start,3),
+        "shortages_per_day": shortages,
+        "mean_shortages": float(np.mean(shortages)) if shortages else 0.0,
+        "mean_shortage_units": float(np.mean(shortage_units)) if shortage_units else 0.0,
+        "accepted": accepted,
+        "rejected": rejected,
+        "idle_days": idle,
+        "units_moved": units_moved,
+        "final_weights": {k: round(v,4) for k,v in state["recommendation_weights"].items()},
+    }
+
+def run_quiet(scenario: dict):
+    with logs_to_stderr():
+        return run_scenario(scenario)
+
+def build_scenarios(args):
+    return [
+        {"seed":seed,"hospitals":hospitals,"resources":args.resources,"days":args.days,
+         "policy":policy,"weights":weights,"reports_per_day":args.reports_per_day,"stock_scale":args.stock_scale}
+        for seed,hospitals,policy,weights in itertools.product(args.seeds,args.hospitals,args.policies,args.weights)
+    ]
+
+def summarize(results: list):
+    """Average metrics of every (hospitals, policy, weights) cell over seeds"""
+    cells = {}
+    for res in results:
+        cells.setdefault((res["hospitals"],res["policy"],res["weights"]),[]).append(res)
+    return [
+        {"hospitals":hospitals,"policy":policy,"weights":weights,"runs":len(runs),
+         "mean_shortages":float(np.mean([r["mean_shortages"] for r in runs])),
+         "mean_shortage_units":float(np.mean([r["mean_shortage_units"] for r in runs])),
+         "units_moved":float(np.mean([r["units_moved"] for r in runs])),
+         "accept_rate":float(np.mean([r["accepted"]/max(r["days"],1) for r in runs]))}
+        for (hospitals,policy,weights),runs in sorted(cells.items())
+    ]
+
+
+if __name__ == "__main__":
+    parser = runner_parser(__doc__)
+    parser.add_argument("--days",type=int,default=30)
+    parser.add_argument("--seeds",type=int,nargs="+",default=[1,2,3])
+    parser.add_argument("--hospitals",type=int,nargs="+",default=[5,20])
+    parser.add_argument("--resources",nargs="+",default=DEFAULT_RESOURCES)
+    parser.add_argument("--policies",nargs="+",choices=sorted(POLICIES),default=["accept","random"])
+    parser.add_argument("--weights",nargs="+",choices=sorted(WEIGHT_SETS),default=["balanced"])
+    parser.add_argument("--reports-per-day",type=int,default=1)
+    parser.add_argument("--workers",type=int,default=os.cpu_count())
+    args = parser.parse_args()
+
+    scenarios = build_scenarios(args)
+    print(f"INFO: running {len(scenarios)} scenarios on {args.workers} workers",file=sys.stderr)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run_quiet,scenario): scenario for scenario in scenarios}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"ERROR: scenario {futures[future]} failed {str(e)}",file=sys.stderr)
+    results.sort(key=lambda r: (r["hospitals"],r["policy"],r["weights"],r["seed"]))
+
+    write_report({"config": vars(args),"summary": summarize(results),"scenarios": results},args.output)
@@ -0,0 +1,85 @@
+import os
+import importlib.util
+from abc import ABC,abstractmethod
+
+import pandas as pd
+
+
+class StorageBackend(ABC):
+    """Base class for writing and reading state dataframes to disk"""
+
+    name = ""
+    ext = ""
+
+    def __init__(self,root: str):
+        self.root = root
+        os.makedirs(root,exist_ok=True)
+
+    def path(self,key: str):
+        return os.path.join(self.root,f"{key}.{self.ext}")
+
+    def exists(self,key: str):
+        return os.path.exists(self.path(key))
+
+    @abstractmethod
+    def write_frame(self,key: str,df: pd.DataFrame,index: bool = False):
+        ...
+
+    @abstractmethod
+    def read_frame(self,key: str):
+        ...
+
+
+class CsvBackend(StorageBackend):
+    """Plain csv files, kept for compatibility with older saves"""
+
+    name = "csv"
+    ext = "csv"
+
+    def write_frame(self,key: str,df: pd.DataFrame,index: bool = False):
+        df.to_csv(self.path(key),index=index)
+
+    def read_frame(self,key: str):
+        df = pd.read_csv(self.path(key))
+        #an unnamed first column is a written index
+        if len(df.columns) and str(df.columns[0]).startswith("Unnamed"):
+            df = df.set_index(df.columns[0])
+            df.index.name = None
+        if "date" in df.columns:
+            df["date"] = pd.to_datetime(df["date"])
+        return df
+
+
+class ParquetBackend(StorageBackend):
+    """Columnar parquet files, keeps dtypes (dates, ints) and the index intact"""
+
+    name = "parquet"
+    ext = "parquet"
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("pyarrow") is not None
+
+    def write_frame(self,key: str,df: pd.DataFrame,index: bool = False):
+        df.to_parquet(self.path(key),index=index)
+
+    def read_frame(self,key: str):
+        return pd.read_parquet(self.path(key))
+
+
+BACKENDS = {
+    CsvBackend.name: CsvBackend,
+    ParquetBackend.name: ParquetBackend,
+}
+
+
+def get_backend(name: str,root: str):
+    """Get a storage backend by name, falls back to csv if it can't be used"""
+    backend_cls = BACKENDS.get(name)
+    if backend_cls is None:
+        print(f"WARNING: unknown storage backend {name}, using csv")
+        backend_cls = CsvBackend
+    elif backend_cls is ParquetBackend and not ParquetBackend.available():
+        print("WARNING: pyarrow is not installed, using csv storage backend")
+        backend_cls = CsvBackend
+    return backend_cls(root)
@@ -1,12 +1,60 @@
 from agent.core import State
+from agent.persistence import record_delta
+from agent.window import RollingWindow,get_window
+
+import numpy as np
+
+
+class TrackedView:
+    """The tracked hospitals as sorted integer codes into a rolling window, their rows are only built when read"""
+
+    def __init__(self,window: RollingWindow,hospitals):
+        self.window = window
+        self.selection = frozenset(hospitals)
+        codes = window.encode(sorted(self.selection))
+        self.codes = np.sort(codes[codes >= 0])
+
+    @property
+    def hospitals(self):
+        """Tracked hospital names in window order"""
+        return [self.window.hospitals[c] for c in self.codes]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def tensor(self,columns: list):
+        return self.window.tensor(columns,codes=self.codes)
+
+    def resource_tensor(self,kind: str):
+        return self.window.resource_tensor(kind,codes=self.codes)
+
+    def latest(self,kind: str):
+        return self.window.latest(kind,self.codes)
+
+    def frame(self):
+        """Tracked rows as a DataFrame, cached by the window until its next append"""
+        return self.window.frame(codes=self.codes)
+
+
+def get_tracking(state: State):
+    """View of the tracked hospitals, rebuilt only if the window or the selection changed"""
+    window = get_window(state)
+    view = state.get("tracking")
+    if view is None or view.window is not window or view.selection != state["tracking_hosps"]:
+        view = TrackedView(window,state["tracking_hosps"])
+        state["tracking"] = view
+    return view
+
+def tracking_data(state: State):
+    """Rows of the tracked hospitals over the window"""
+    return get_tracking(state).frame()
 
 
 def setup_tracking(state: State, selected_hospitals: list = None):
     """Track specific hospitals, works for CLI or frontend-provided selection."""
     try:
         
-        df = state["window_data"]
-        all_hosp = list(df["hospital"].unique())
+        all_hosp = list(get_window(state).hospitals)
         current_selection = state["tracking_hosps"]
 
 
@@ -36,14 +84,14 @@ def setup_tracking(state: State, selected_hospitals: list = None):
         if len(selected_hospitals)<2:
             raise ValueError("Leave at least 2 hospitals for tracking")
 
-        selected_df = df[df["hospital"].isin(selected_hospitals)]
         state["tracking_hosps"] = set(selected_hospitals)
-        state["tracking_data"] = selected_df
+        view = get_tracking(state)
+        record_delta(state,"track",hospitals=sorted(state["tracking_hosps"]))
 
 
         if selected_hospitals is None:
             print(state["tracking_hosps"])
-            print("Hospitals present:", selected_df["hospital"].unique())
+            print("Hospitals present:", view.hospitals)
     except Exception as e:
         print(f"ERROR: during tracking {str(e)}")
         print(f"{type(e).__name__}")
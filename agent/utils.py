@@ -1,47 +1,161 @@
-from agent.core import State
-
 import json
 import re
+import threading
 
-from faiss import IndexFlatL2
-from sentence_transformers import SentenceTransformer
-
-model = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 dims = 384
-index = IndexFlatL2(dims)
 
-def parse_model_res(res_content: str):
+_model = None
+_loader = None
+_load_lock = threading.Lock()
+
+def get_model():
+    """Sentence transformer loaded on first use.
+
+    The module lives in sys.modules for the whole server process, so every streamlit session and rerun shares this one instance.
+    """
+    global _model
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                print("INFO: loading embedding model")
+                _model = SentenceTransformer(EMBEDDING_MODEL)
+    return _model
+
+def preload_model():
+    """Start loading the embedding model in a background thread, so requests never wait on it"""
+    global _loader
+    if _model is None and _loader is None:
+        _loader = threading.Thread(target=get_model,name="embedding-model-loader",daemon=True)
+        _loader.start()
+
+def model_ready():
+    return _model is not None
+
+#python style literals some answers slip in, read as their json counterparts
+JSON_LITERALS = {"None":"null","True":"true","False":"false","NaN":"null"}
+CLOSERS = {"{":"}","[":"]"}
+#set by repair_json on every object it had to close because the answer was cut off inside it
+TRUNCATED_KEY = "_truncated"
+
+
+def stream_writer():
+    """Writer for custom events of the graph run this is called in, a no-op when called outside one"""
     try:
-        pattern = r"```json(.*?)```"
-        matches = re.findall(pattern, res_content, re.DOTALL)
-        if matches:
-            json_str = matches[0].strip()
-        else:
-            # fallback: assume whole response is JSON
-            json_str = res_content.strip()
-
-        json_content = json.loads(json_str)
-        
-        return json_content
-    
-    except Exception as e:
-        print(f"json parse error: {str(e)}")
-        raise
+        from langgraph.config import get_stream_writer
+        return get_stream_writer()
+    except (ImportError,RuntimeError):
+        return lambda chunk: None
+
+def extract_json_text(res_content: str):
+    """The json part of a model answer, the ```json block if there is one else from the first bracket on"""
+    matches = re.findall(r"```(?:json)?(.*?)(?:```|$)",res_content,re.DOTALL)
+    if matches and matches[0].strip():
+        return matches[0].strip()
+    starts = [i for i in (res_content.find("{"),res_content.find("[")) if i >= 0]
+    return res_content[min(starts):].strip() if starts else res_content.strip()
+
+def repair_json(text: str):
+    """Best effort fix of almost json: trailing commas, python literals, keys without values and answers cut off midway.
+
+    Walks the text once keeping the bracket stack, then closes whatever is still open, marking each
+    closed object with TRUNCATED_KEY. If that is not valid json the text is cut back to the last
+    complete element and closed again.
+    """
+    text = text.replace("\u201c",'"').replace("\u201d",'"')
+    out = []
+    stack = []
+    cuts = []
+    in_string = False
+    escaped = False
+    expect_key = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                rest = text[i+1:].lstrip()
+                if expect_key and stack and stack[-1] == "{" and not rest.startswith(":"):
+                    #a key the model left without a value
+                    out.append(":null")
+                    expect_key = False
+            i += 1
+            continue
+
+        if char in ",}" and next((c for c in reversed(out) if c.strip()),"").endswith(":"):
+            #a key followed straight by a comma or the end of its object
+            out.append("null")
+        if char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(char)
+            expect_key = char == "{"
+        elif char in "}]":
+            #drop a trailing comma before the closing bracket
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            expect_key = False
+        elif char == ",":
+            cuts.append((len(out),list(stack)))
+            expect_key = bool(stack) and stack[-1] == "{"
+        elif char == ":":
+            expect_key = False
+        elif char.isalpha():
+            word = re.match(r"[A-Za-z]+",text[i:]).group(0)
+            out.append(JSON_LITERALS.get(word,word))
+            i += len(word)
+            continue
+        out.append(char)
+        i += 1
+
+    def closed(chars: list,open_brackets: list,open_string: bool = False):
+        body = "".join(chars) + ('"' if open_string else "")
+        body = re.sub(r"[\s,]*$","",body)
+        if body.endswith(":"):
+            body += "null"
+        for bracket in reversed(open_brackets):
+            if bracket == "{":
+                body += ("" if body.endswith("{") else ",") + f'"{TRUNCATED_KEY}":true'
+            body += CLOSERS[bracket]
+        return body
 
-def append_to_index(state: State,text):
-    """Add recommendations to faiss index"""
+    attempts = [closed(out,stack,in_string)] + [closed(out[:pos],brackets) for pos,brackets in reversed(cuts)]
+    for attempt in attempts:
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            continue
+    raise ValueError("could not repair json")
 
-    print("INFO: encoding recommendation")
+def parse_partial(res_content: str):
+    """What can be read of an answer that is still streaming in, None if nothing yet"""
     try:
-        emb = model.encode([text])
-        distance,_ = index.search(emb,1)
-        if(distance[0,0] < 0.8):
-            index.add(emb)
-            state["prev_recommendations"][emb] = text
-    except Exception as e:
-        print(f"ERROR: during appending to faiss index {str(e)}")
-        print(f"{type(e).__name__}")
-    return state 
+        return repair_json(extract_json_text(res_content))
+    except ValueError:
+        return None
 
+def parse_model_res(res_content: str):
+    """Json object of a model answer, repaired locally when it is not quite valid json"""
+    try:
+        json_str = extract_json_text(res_content)
+        try:
+            return json.loads(json_str)
+        except ValueError:
+            json_content = repair_json(json_str)
+            print("WARNING: model answer was not valid json, repaired it locally")
+            return json_content
 
-    
\ No newline at end of file
+    except Exception as e:
+        print(f"json parse error: {str(e)}")
+        raise
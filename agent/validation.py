@@ -0,0 +1,168 @@
+import re
+import difflib
+
+from agent.utils import TRUNCATED_KEY
+
+SEVERITY_ORDER = ["mild","moderate","severe","critical"]
+REPORT_EVENTS = ["shortage","restock","maintenance","surge","stable","unknown"]
+REPORT_FIELDS = ["hospital","region","resource","event","change_estimate_pct","reason","severity","confidence"]
+#how close a misspelt name has to be to a known one before it is mapped onto it
+NAME_MATCH_CUTOFF = 0.75
+
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def coerce_float(value):
+    """Number in `value` ("20", "~20 units", 20.0), None if there is none"""
+    if isinstance(value,bool) or value is None:
+        return None
+    if isinstance(value,(int,float)):
+        return float(value)
+    match = NUMBER_PATTERN.search(str(value).replace(",",""))
+    return float(match.group(0)) if match else None
+
+def coerce_int(value):
+    number = coerce_float(value)
+    return int(round(number)) if number is not None else None
+
+def coerce_text(value):
+    if value is None:
+        return None
+    if isinstance(value,(list,tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value).strip()
+
+def normalize_name(name: str):
+    return re.sub(r"[^a-z0-9]","",str(name).lower())
+
+def match_name(name,choices):
+    """The entry of `choices` that `name` means, None if nothing is close enough.
+
+    Exact and case or punctuation insensitive matches come first. Fuzzy matches must keep the same
+    digits, so hos_12 never turns into hos_13, and must be the single best candidate.
+    """
+    if name is None:
+        return None
+    name = str(name).strip()
+    if name in choices:
+        return name
+    key = normalize_name(name)
+    if not key:
+        return None
+    normalized = {}
+    for choice in choices:
+        normalized.setdefault(normalize_name(choice),choice)
+    if key in normalized:
+        return normalized[key]
+
+    digits = re.findall(r"\d+",key)
+    pool = [norm for norm in normalized if re.findall(r"\d+",norm) == digits]
+    if digits and len(pool) == 1:
+        #the number pins the hospital down, the letters only have to look alike
+        letters = difflib.SequenceMatcher(None,re.sub(r"\d","",key),re.sub(r"\d","",pool[0])).ratio()
+        return normalized[pool[0]] if letters >= 0.5 else None
+    ratios = sorted(((difflib.SequenceMatcher(None,key,norm).ratio(),norm) for norm in pool),reverse=True)
+    if not ratios or ratios[0][0] < NAME_MATCH_CUTOFF or (len(ratios) > 1 and ratios[1][0] == ratios[0][0]):
+        return None
+    return normalized[ratios[0][1]]
+
+def validate_report(res_dict: dict,resources: list = (),regions: list = (),hospitals: list = ()):
+    """Report extraction coerced to the report schema: every field present, known events and severities,
+    numeric confidence in [0, 1] and names mapped onto the known ones where they are close enough"""
+    if isinstance(res_dict,list):
+        res_dict = next((item for item in res_dict if isinstance(item,dict)),None)
+    if not isinstance(res_dict,dict):
+        raise ValueError(f"expected a report object, got {type(res_dict).__name__}")
+    report = {field: res_dict.get(field) for field in REPORT_FIELDS}
+
+    for field in ("hospital","region","resource","reason"):
+        report[field] = coerce_text(report[field]) or None
+        if report[field] and report[field].lower() in ("null","none","unknown","n/a"):
+            report[field] = None
+    report["hospital"] = match_name(report["hospital"],hospitals) or report["hospital"]
+    report["resource"] = match_name(report["resource"],resources) or report["resource"]
+    if report["region"]:
+        report["region"] = match_name(report["region"],regions) or report["region"].lower()
+
+    event = (coerce_text(report["event"]) or "").lower()
+    report["event"] = event if event in REPORT_EVENTS else match_name(event,REPORT_EVENTS) or "unknown"
+    severity = (coerce_text(report["severity"]) or "").lower()
+    report["severity"] = severity if severity in SEVERITY_ORDER else match_name(severity,SEVERITY_ORDER)
+
+    report["change_estimate_pct"] = coerce_int(report["change_estimate_pct"])
+    confidence = coerce_float(report["confidence"])
+    if confidence is not None:
+        #a percentage instead of a fraction
+        confidence = confidence/100 if 1 < confidence <= 100 else confidence
+        confidence = min(max(confidence,0.0),1.0)
+    report["confidence"] = confidence
+    return report
+
+
+def validate_recommendation(item: dict,hospitals: list,resources: list,available):
+    """Slate alternative coerced to the recommendation schema, None if it can't be salvaged.
+
+    `meta` must be one object naming known hospitals and a known resource, close misspellings are
+    mapped onto them and the texts corrected to match, only an explicit null `meta` means there is
+    nothing to move. The quantity becomes an integer no larger than what every provider can give,
+    `available(hospital, resource)` returns that amount or None if unknown. Alternatives the answer was
+    cut off in are never used.
+    """
+    if not isinstance(item,dict) or item.get(TRUNCATED_KEY) or "meta" not in item:
+        return None
+    item = dict(item)
+    item["recommendation"] = coerce_text(item.get("recommendation")) or ""
+    item["justification"] = coerce_text(item.get("justification")) or ""
+    meta = item["meta"]
+    if isinstance(meta,list):
+        meta = next((m for m in meta if isinstance(m,dict)),{})
+    if meta is None:
+        #an answer saying there is nothing to move
+        return item if item["recommendation"] else None
+    if not meta or not isinstance(meta,dict):
+        return None
+
+    fixes = {}
+    def known(name,choices):
+        matched = match_name(name,choices)
+        if matched is not None and str(name).strip() != matched:
+            fixes[str(name).strip()] = matched
+        return matched
+
+    from_hosp = meta.get("from",[])
+    if isinstance(from_hosp,str):
+        #a list written out as a string, "[hos_1, hos_2]"
+        from_hosp = [part.strip(" '\"") for part in from_hosp.strip("[]").split(",")]
+    to_hosp = meta.get("to")
+    if isinstance(to_hosp,list):
+        to_hosp = to_hosp[0] if to_hosp else None
+    to_hosp = known(to_hosp,hospitals)
+    resource = known(meta.get("resource"),resources)
+    providers = []
+    for hosp in from_hosp or []:
+        hosp = known(hosp,hospitals)
+        if hosp is not None and hosp != to_hosp and hosp not in providers:
+            providers.append(hosp)
+    if to_hosp is None or resource is None or not providers:
+        return None
+
+    quantity = coerce_int(meta.get("quantity"))
+    if quantity is None:
+        return None
+    amounts = [available(hosp,resource) for hosp in providers]
+    amounts = [amount for amount in amounts if amount is not None]
+    limit = int(min(amounts)) if amounts else quantity
+    if quantity > limit:
+        fixes[str(quantity)] = str(limit)
+        quantity = limit
+    if quantity < 1:
+        return None
+
+    for wrong,right in fixes.items():
+        pattern = rf"(?<![\w.]){re.escape(wrong)}(?![\w.])"
+        item["recommendation"] = re.sub(pattern,right,item["recommendation"],flags=re.IGNORECASE)
+        item["justification"] = re.sub(pattern,right,item["justification"],flags=re.IGNORECASE)
+    if fixes:
+        print(f"WARNING: repaired recommendation {fixes}")
+    item["meta"] = {**meta,"from":providers,"to":to_hosp,"resource":resource,"quantity":quantity}
+    return item
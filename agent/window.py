@@ -0,0 +1,224 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from agent.codebook import Codebook,RESOURCE_KINDS
+
+WINDOW_DAYS = 14
+
+
+class RollingWindow:
+    """The last `days` days of per hospital data in a preallocated (days, hospitals, columns) ring buffer"""
+
+    def __init__(self,codebook: Codebook,fields: list,days: int = WINDOW_DAYS,layout: list = None,dtypes: dict = None):
+        self.days = days
+        self.codebook = codebook
+        self.fields = list(fields)
+        self.resources = list(codebook.resources)
+        #plain fields then one block per resource, so resources can be read as an axis
+        self.columns = self.fields + [f"{res}_{kind}" for res in self.resources for kind in RESOURCE_KINDS]
+        self.col_codes = {col: i for i,col in enumerate(self.columns)}
+        self.layout = layout or ["hospital","region","date",*self.columns]
+        self.dtypes = dtypes or {}
+        n_hosps = len(codebook.hospitals)
+        self.region = np.full(n_hosps,-1,dtype=int)
+        self.values = np.full((days,n_hosps,len(self.columns)),np.nan)
+        self.dates = np.full(days,np.datetime64("NaT"),dtype="datetime64[ns]")
+        #taken when a day is written, fingerprinting the window never hashes more than the changed day
+        self.slot_digests = [None]*days
+        self.start = 0
+        self.size = 0
+        self.version = 0
+        self._frames = {}
+
+    @classmethod
+    def from_frame(cls,df: pd.DataFrame,codebook: Codebook = None,days: int = WINDOW_DAYS):
+        """Window over every hospital in `df`, filled with its most recent `days` dates"""
+        codebook = codebook or Codebook.from_frame(df)
+        resource_cols = {f"{res}_{kind}" for res in codebook.resources for kind in RESOURCE_KINDS}
+        fields = [col for col in df.columns if col not in ("hospital","region","date") and col not in resource_cols
+                  and pd.api.types.is_numeric_dtype(df[col])]
+        window = cls(codebook,fields,days,layout=list(df.columns))
+        for _,day_df in codebook.categorize(df).groupby("date",sort=True):
+            window.append(day_df)
+        return window
+
+    @property
+    def hospitals(self):
+        return self.codebook.hospitals
+
+    def encode(self,hospitals: list):
+        """Integer codes of `hospitals`, -1 for hospitals outside the window"""
+        return self.codebook.encode(hospitals)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        """Make room for hospitals added to the codebook since the buffer was allocated"""
+        extra = len(self.codebook.hospitals) - self.values.shape[1]
+        if extra > 0:
+            self.values = np.concatenate([self.values,np.full((self.days,extra,len(self.columns)),np.nan)],axis=1)
+            self.region = np.concatenate([self.region,np.full(extra,-1,dtype=int)])
+            for slot in self._slots():
+                self._digest(slot)
+
+    def _slots(self):
+        """Buffer slots from the oldest to the newest day"""
+        return (self.start + np.arange(self.size)) % self.days
+
+    def ordered_dates(self):
+        return self.dates[self._slots()]
+
+    def _slot_for(self,date: np.datetime64):
+        """Slot to write `date` into, evicting the oldest day if needed, None if it is too old to keep"""
+        held = self.dates[self._slots()]
+        match = np.nonzero(held == date)[0]
+        if len(match):
+            return self._slots()[match[0]]
+        if self.size and date < held[-1]:
+            #an older day arriving late, reorder once instead of keeping the hot path general
+            if self.size == self.days and date < held[0]:
+                return None
+            return self._reorder(int(np.searchsorted(held,date)))
+        if self.size < self.days:
+            slot = (self.start + self.size) % self.days
+            self.size += 1
+            return slot
+        slot = self.start
+        self.start = (self.start + 1) % self.days
+        return slot
+
+    def _reorder(self,position: int):
+        """Rebuild the buffer oldest first with an empty slot at `position` and return that slot"""
+        slots = self._slots()
+        values = self.values[slots]
+        dates = self.dates[slots]
+        if self.size == self.days:
+            #the oldest day makes room for the late one
+            values,dates,position = values[1:],dates[1:],position - 1
+        keep = len(dates)
+        self.values[:] = np.nan
+        self.dates[:] = np.datetime64("NaT")
+        self.values[:position] = values[:position]
+        self.dates[:position] = dates[:position]
+        self.values[position+1:keep+1] = values[position:]
+        self.dates[position+1:keep+1] = dates[position:]
+        self.start = 0
+        self.size = keep + 1
+        for slot in range(self.size):
+            if slot != position:
+                self._digest(slot)
+        return position
+
+    def _digest(self,slot: int):
+        self.slot_digests[slot] = hashlib.blake2b(self.values[slot].tobytes(),digest_size=16).hexdigest()
+
+    def append(self,day_df: pd.DataFrame):
+        """Write one day of rows (one per hospital) into the window, a date already held is overwritten"""
+        dates = day_df["date"].unique()
+        if len(dates) != 1:
+            raise ValueError(f"expected rows of a single date, got {len(dates)}")
+        date = np.datetime64(pd.Timestamp(dates[0]),"ns")
+        slot = self._slot_for(date)
+        if slot is None:
+            print(f"WARNING: {dates[0]} is older than the rolling window, skipping it")
+            return self
+
+        day_df = self.codebook.categorize(day_df.drop_duplicates("hospital",keep="last"))
+        self._grow()
+        codes = day_df["hospital"].cat.codes.to_numpy()
+        if "region" in day_df.columns:
+            self.region[codes] = day_df["region"].cat.codes.to_numpy()
+        present = [col for col in self.columns if col in day_df.columns]
+        self.values[slot] = np.nan
+        self.values[slot][codes[:,None],[self.col_codes[col] for col in present]] = day_df[present].to_numpy(dtype=float)
+        self.dates[slot] = date
+        self._digest(slot)
+        self.dtypes.setdefault("date",day_df["date"].dtype)
+        for col in present:
+            self.dtypes[col] = np.result_type(self.dtypes.get(col,day_df[col].dtype),day_df[col].dtype)
+
+        self.version += 1
+        self._frames = {}
+        return self
+
+    def _hospital_index(self,hospitals: list = None,codes: np.ndarray = None):
+        if codes is not None:
+            return np.asarray(codes,dtype=int)
+        return np.arange(self.values.shape[1]) if hospitals is None else self.encode(hospitals)
+
+    def _select(self,values: np.ndarray,hosp_idx: np.ndarray):
+        """(hospital, date, ...) array of `values` (date, hospital, ...) for `hosp_idx`, nan rows for unknown codes"""
+        out = np.full((len(hosp_idx),*values.shape[:1],*values.shape[2:]),np.nan)
+        known = hosp_idx >= 0
+        out[known] = np.swapaxes(values[:,hosp_idx[known]],0,1)
+        return out
+
+    def tensor(self,columns: list,hospitals: list = None,codes: np.ndarray = None):
+        """(hospital, date, column) array of the held days, oldest first, nan where a hospital has no row"""
+        col_idx = np.array([self.col_codes[col] for col in columns],dtype=int)
+        return self._select(self.values[self._slots()][:,:,col_idx],self._hospital_index(hospitals,codes))
+
+    def resource_tensor(self,kind: str,hospitals: list = None,codes: np.ndarray = None):
+        """(hospital, date, resource) array of one kind (stock or usage) for every codebook resource"""
+        n_fields = len(self.fields)
+        block = self.values[self._slots()][:,:,n_fields:].reshape(self.size,self.values.shape[1],len(self.resources),len(RESOURCE_KINDS))
+        return self._select(block[...,RESOURCE_KINDS.index(kind)],self._hospital_index(hospitals,codes))
+
+    def latest(self,kind: str,codes: np.ndarray):
+        """(hospital, resource) array of each hospital's most recent `kind` values"""
+        values = self.resource_tensor(kind,codes=codes)
+        if not values.shape[1]:
+            return np.full((len(values),len(self.resources)),np.nan)
+        has_row = ~np.isnan(values).all(axis=2)
+        last = values.shape[1] - 1 - np.argmax(has_row[:,::-1],axis=1)
+        latest = values[np.arange(len(values)),last]
+        latest[~has_row.any(axis=1)] = np.nan
+        return latest
+
+    def fingerprint_parts(self):
+        """What the window holds, for content fingerprints of the state, days enter by their slot digests"""
+        return (self.hospitals,self.columns,self.ordered_dates(),self.region,[self.slot_digests[s] for s in self._slots()])
+
+    def hospital_regions(self):
+        """Region of every hospital with rows in the window, indexed by hospital name"""
+        known = np.nonzero(self.region >= 0)[0]
+        return pd.Series(np.asarray(self.codebook.regions,dtype=object)[self.region[known]],
+                         index=np.asarray(self.hospitals,dtype=object)[known],dtype=object)
+
+    def frame(self,hospitals = None,codes: np.ndarray = None):
+        """Rows of the held days for `hospitals` or `codes` (all by default), hospital major and oldest date first"""
+        if codes is None and hospitals is not None:
+            codes = self.encode(hospitals)
+        key = None if codes is None else tuple(sorted(int(c) for c in codes if c >= 0))
+        if key in self._frames:
+            return self._frames[key]
+
+        hosp_idx = np.arange(self.values.shape[1]) if key is None else np.array(key,dtype=int)
+        values = self.values[self._slots()][:,hosp_idx].transpose(1,0,2).reshape(-1,len(self.columns))
+        present = ~np.isnan(values).all(axis=1)
+
+        columns = {
+            "hospital": pd.Categorical.from_codes(np.repeat(hosp_idx,self.size)[present],categories=self.codebook.hospitals),
+            "region": pd.Categorical.from_codes(np.repeat(self.region[hosp_idx],self.size)[present],categories=self.codebook.regions),
+            "date": np.tile(self.ordered_dates(),len(hosp_idx))[present],
+        }
+        for c,col in enumerate(self.columns):
+            columns[col] = values[present,c]
+
+        df = pd.DataFrame(columns)[[col for col in self.layout if col in columns]]
+        df = df.astype({col: dtype for col,dtype in self.dtypes.items() if col in df.columns})
+        self._frames[key] = df
+        return df
+
+
+def get_window(state: dict):
+    """The state's rolling window, None before the first data drop"""
+    return state.get("window")
+
+def window_data(state: dict):
+    """Rows of every hospital over the window, built on first read after an append and cached by the window"""
+    window = get_window(state)
+    return window.frame() if window is not None else pd.DataFrame()
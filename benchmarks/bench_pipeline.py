@@ -0,0 +1,123 @@
+"""Scaling benchmark for the forecasting and recommendation pipeline.
+
+Generates synthetic fleets of increasing size and times each pipeline stage with the LLM replaced
+by a local stub. Results are written as json so scaling curves can be compared across commits.
+
+    python -m benchmarks.bench_pipeline --hospitals 10 100 1000 --resources 4 25 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import subprocess
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO_ROOT)
+
+from agent.runner import runner_parser,scratch_dir,logs_to_stderr,write_report
+
+STAGES = ["ingest_knowledge","ingest_daily_reports","forecast_data","draw_conclusions",
+          "prepare_candidates","rank_candidates","save_state","load_state"]
+
+
+class StubResponse:
+    def __init__(self,text: str):
+        self.text = text
+
+
+class StubLLM:
+    """Stands in for the genai client, answers every prompt with the same structured report"""
+
+    def __init__(self):
+        self.models = self
+        self.calls = 0
+
+    def generate_content(self,model,contents,config = None):
+        self.calls += 1
+        return StubResponse(json.dumps({
+            "hospital": None,"region": None,"resource": None,"event": "surge",
+            "change_estimate_pct": 20,"reason": "benchmark","severity": "severe","confidence": 0.9,
+        }))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=REPO_ROOT,text=True,stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def timed(fn,*args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result,time.perf_counter() - start
+
+def bench_fleet(n_hospitals: int,n_resources: int,repeat: int,stock_scale: float):
+    from agent import data_ingestor
+    from agent.data_ingestor import ingest_knowledge,ingest_daily_reports
+    from agent.forecasting import forecast_data,draw_conclusions,prepare_candidates
+    from agent.recommendations import rank_candidates
+    from agent.persistence import save_state,load_state
+    from agent.window import window_data
+    from agent.graph import new_state
+
+    data_ingestor.llm_client = StubLLM()
+    timings = {stage: [] for stage in STAGES}
+    counts = {}
+    for _ in range(repeat):
+        #stocks are scaled down when generated so the fleet actually has shortages to match
+        state = new_state(num_hospitals=n_hospitals,resource_names=[f"resource_{i}" for i in range(n_resources)],
+                          stock_scale=stock_scale)
+        state,elapsed = timed(ingest_knowledge,state)
+        timings["ingest_knowledge"].append(elapsed)
+
+        for stage,fn in (("ingest_daily_reports",ingest_daily_reports),("forecast_data",forecast_data),("draw_conclusions",draw_conclusions)):
+            state,elapsed = timed(fn,state)
+            timings[stage].append(elapsed)
+
+        candidates,elapsed = timed(prepare_candidates,state)
+        timings["prepare_candidates"].append(elapsed)
+        #ranking alone, on the candidates matched above
+        _,elapsed = timed(rank_candidates,state,3,candidates)
+        timings["rank_candidates"].append(elapsed)
+
+        _,elapsed = timed(save_state,state)
+        timings["save_state"].append(elapsed)
+        _,elapsed = timed(load_state)
+        timings["load_state"].append(elapsed)
+
+        counts = {"rows": int(len(window_data(state))),"shortages": len(state["shortages"]),
+                  "surpluses": len(state["surpluses"]),"candidates": len(candidates or [])}
+
+    return [
+        {"hospitals": n_hospitals,"resources": n_resources,"stage": stage,
+         "median_s": float(np.median(values)),"min_s": float(np.min(values)),"runs": len(values),**counts}
+        for stage,values in timings.items()
+    ]
+
+
+if __name__ == "__main__":
+    parser = runner_parser(__doc__)
+    parser.add_argument("--hospitals",type=int,nargs="+",default=[10,100,1000,5000])
+    parser.add_argument("--resources",type=int,nargs="+",default=[4,25,100])
+    parser.add_argument("--repeat",type=int,default=3)
+    args = parser.parse_args()
+
+    results = []
+    with scratch_dir("medical_agent_bench_"):
+        for n_hospitals in args.hospitals:
+            for n_resources in args.resources:
+                print(f"INFO: benchmarking {n_hospitals} hospitals x {n_resources} resources",file=sys.stderr)
+                with logs_to_stderr():
+                    results.extend(bench_fleet(n_hospitals,n_resources,args.repeat,args.stock_scale))
+
+    write_report({
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {"repeat": args.repeat,"stock_scale": args.stock_scale},
+        "results": results,
+    },args.output)
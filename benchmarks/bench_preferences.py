@@ -0,0 +1,62 @@
+"""Benchmark rejection handling in get_feedback.
+
+Compares the old per-call concept encoding and pairwise cosine loop with PreferenceAttributor,
+which caches concept embeddings and scores both texts with one batch encode and one matrix product.
+
+    python -m benchmarks.bench_preferences --repeat 20
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from agent.preferences import PreferenceAttributor,CONCEPTS
+from agent.utils import get_model
+
+FEEDBACK = "the donor hospital is too far away, transport would cost too much"
+JUSTIFICATION = "hos_3 has the largest oxygen surplus and the transfer covers most of the forecasted shortage at hos_1."
+
+
+def per_call_offsets(model,feedback: str,justification: str,delta_max: float = 0.1):
+    """The previous implementation, three encode calls and eight 1x384 cosine similarities"""
+    from sklearn.metrics.pairwise import cosine_similarity
+    concept_embs = {k: model.encode(v,normalize_embeddings=True) for k,v in CONCEPTS.items()}
+    feedback_emb = model.encode(feedback,normalize_embeddings=True).reshape(1,-1)
+    justification_emb = model.encode(justification,normalize_embeddings=True).reshape(1,-1)
+    offsets = {}
+    for concept,emb in concept_embs.items():
+        feedback_sim = cosine_similarity(feedback_emb,emb.reshape(1,-1))[0][0]
+        justification_sim = cosine_similarity(justification_emb,emb.reshape(1,-1))[0][0]
+        sim = 0.4*feedback_sim + 0.6*justification_sim
+        offsets[concept] = float((max(sim,0.08) - 0.08)/(0.6)*delta_max)
+    return offsets
+
+def time_calls(fn,repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result,timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat",type=int,default=20)
+    args = parser.parse_args()
+
+    model = get_model()
+    attributor = PreferenceAttributor(model=model)
+    #first call pays for the concept embeddings, like the first rejection in a session
+    attributor.offsets(FEEDBACK,JUSTIFICATION)
+
+    old,old_times = time_calls(lambda: per_call_offsets(model,FEEDBACK,JUSTIFICATION),args.repeat)
+    new,new_times = time_calls(lambda: attributor.offsets(FEEDBACK,JUSTIFICATION),args.repeat)
+
+    print(json.dumps({
+        "repeat": args.repeat,
+        "per_call_ms": round(1000*float(np.median(old_times)),3),
+        "attributor_ms": round(1000*float(np.median(new_times)),3),
+        "max_offset_diff": max(abs(old[k] - new[k]) for k in CONCEPTS),
+    },indent=4))
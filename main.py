@@ -1,69 +1,35 @@
-from langgraph.graph import StateGraph,START,END
 import pandas as pd
 
 from agent.core import State
 
-from agent.data_ingestor import ingest_knowledge,ingest_daily_reports
-from agent.forecasting import forecast_data,draw_conclusions
-from agent.recommendations import build_recommendations,get_feedback
+from agent.data_ingestor import ingest_knowledge
+from agent.recommendations import get_feedback,advance_day,streamed_recommendation
 from agent.persistence import save_state,load_state
-from agent.tracking import setup_tracking
-from agent.data_insights import show_insights
+from agent.tracking import setup_tracking,tracking_data
+from agent.window import get_window
+from agent.data_insights import show_insights,show_performance
+from agent.instrumentation import recorder
+from agent.graph import build_graph,new_state
+from agent.utils import preload_model
 
-import datetime
 import os
 
 import streamlit as st
 
-graph_builder = StateGraph(State)
-
-#NODES
-
-graph_builder.add_node(ingest_knowledge)
-graph_builder.add_node(ingest_daily_reports)
-graph_builder.add_node(forecast_data)
-graph_builder.add_node(draw_conclusions)
-graph_builder.add_node(build_recommendations)
-graph_builder.add_node(get_feedback)
-graph_builder.add_node(save_state)
-
-#EDGES
-graph_builder.add_edge(START,"ingest_knowledge")
-graph_builder.add_edge("ingest_knowledge","ingest_daily_reports")
-graph_builder.add_edge("ingest_daily_reports","forecast_data")
-graph_builder.add_edge("forecast_data","draw_conclusions")
-graph_builder.add_edge("draw_conclusions","build_recommendations")
-graph_builder.add_edge("build_recommendations","save_state")
-graph_builder.add_edge("save_state",END)
-
-graph = graph_builder.compile()
-initial_state: State = {
-    "sim_date": datetime.datetime(2025,1,1),
-    "days_since_update":0,
-    "window_data": pd.DataFrame(),
-    "today_data": pd.DataFrame(),
-    "tracking_data":pd.DataFrame(),
-    "distances":pd.DataFrame(),
-    "shortages":list,
-    "surpluses":list,
-    "num_hospitals":0,
-    "resource_names":[],
-    "report_data": {},
-    "today_forecasts": {},
-    "forecast_conclusions": [],
-    "tracking_hosps": set(),
-    "recommendation": "",
-    "recommendation_justification":"",
-    "recommendation_meta":{},
-    "user_feedback":"",
-    "recommendation_weights": {"cost":0.5,"coverage":0.5,"fairness":0.5,"urgency":0.5},
-    "done":False
-}
+@st.cache_resource
+def get_graph():
+    #streamlit reruns the script on every click, the compiled graph and its node caches have to outlive that
+    return build_graph()
+
+graph = get_graph()
+#the recommendation memory needs the embedding model, load it while the user sets things up
+preload_model()
+initial_state: State = new_state()
 
 if __name__ == "__main__":
 
     try:
-        action = st.sidebar.selectbox("Choose Action",["Home","Tracking","Recommend","Insights"])
+        action = st.sidebar.selectbox("Choose Action",["Home","Tracking","Recommend","Insights","Performance"])
 
         if action == "Home":
             st.header("Welcome to the hospital agent dashboard")
@@ -103,11 +69,14 @@ if __name__ == "__main__":
                 final_resources = list(dict.fromkeys(resources + custom_resources))
                 st.write("Final simulation resources:", final_resources)
 
+                reports_per_day = st.number_input("Reports per day:", min_value=1, max_value=50, value=1)
+
                 if st.button("Start Simulation"):
                     print("INFO: pressed start simulation")
                     state = initial_state
                     state["resource_names"] = final_resources
                     state["num_hospitals"] = num_hosp
+                    state["reports_per_day"] = reports_per_day
                     state = ingest_knowledge(state)
                     st.session_state["state"] = state
                     st.success("New simulation started")
@@ -128,10 +97,10 @@ if __name__ == "__main__":
         elif action=="Tracking":
             if("state" not in st.session_state):
                 st.error("Initialize a simulation first!")
-            if(st.session_state["state"]["window_data"].empty or st.session_state["state"]["tracking_data"].empty):
+            if(get_window(st.session_state["state"]) is None or tracking_data(st.session_state["state"]).empty):
                 st.error("Cannot Update Tracking! Run a recommendation first")
             else:
-                all_hospitals = list(st.session_state["state"]["window_data"]["hospital"].unique())
+                all_hospitals = list(get_window(st.session_state["state"]).hospitals)
                 selected_hospitals = st.multiselect(
                     "Select hosps to track",
                     options = all_hospitals,
@@ -146,7 +115,29 @@ if __name__ == "__main__":
                 st.error("Initialize a simulation first!")
             else:
                 if st.button("Get Recommendation"):
-                    st.session_state["state"] = graph.invoke(st.session_state["state"])
+                    #stream node progress and the model's answer instead of waiting for the whole graph
+                    state = st.session_state["state"]
+                    answer = ""
+                    answer_box = None
+                    with st.status("Running pipeline...",expanded=True) as status:
+                        for mode,chunk in graph.stream(state,stream_mode=["values","updates","custom"]):
+                            if mode == "values":
+                                state = chunk
+                            elif mode == "updates":
+                                for node,update in chunk.items():
+                                    st.write(f"Finished {node.replace('_',' ')}")
+                                    if node == "draw_conclusions":
+                                        st.write(f"**{len(update.get('shortages') or [])} shortages, {len(update.get('surpluses') or [])} surpluses forecast**")
+                                        if update.get("shortages"):
+                                            st.dataframe(pd.DataFrame(update["shortages"]),width="stretch")
+                            elif mode == "custom" and "token" in chunk:
+                                answer += chunk["token"]
+                                if answer_box is None:
+                                    answer_box = st.empty()
+                                answer_box.markdown(streamed_recommendation(answer) or "Writing recommendation...")
+                        status.update(label="Recommendation ready",state="complete",expanded=False)
+                    st.session_state["state"] = state
+                    recorder.finish_run()
                     save_state(st.session_state["state"])
 
                 state = st.session_state["state"]
@@ -165,7 +156,7 @@ if __name__ == "__main__":
                     resource = res_meta.get("resource", "")
                     rec_qty = res_meta.get("quantity")
 
-                    today_df = state.get("tracking_data", None)
+                    today_df = tracking_data(state) if state.get("tracking_hosps") else None
                     if today_df is None or resource is None:
                         st.warning("Tracking data or resource not available.")
                     else:
@@ -288,14 +279,24 @@ if __name__ == "__main__":
                                     reason=reason
                                 )
                                 save_state(st.session_state["state"])
-                                st.info("Rejection submitted. Press 'Get Recommendation' to get new recommendation")
+                                st.info("Rejection submitted. Press 'Get Recommendation' to get another recommendation for today")
                                 st.session_state["feedback_mode"] = None
+
+                #a rejection keeps the day, once the recommendation is answered the user can still move on
+                state = st.session_state["state"]
+                if not state.get("recommendation_meta") or state.get("recommendation_rejected"):
+                    if st.button("Next Day"):
+                        st.session_state["state"] = advance_day(state)
+                        save_state(st.session_state["state"])
+                        st.info("Moved to the next day. Press 'Get Recommendation' to get new recommendation")
         elif action=="Insights":
             state = st.session_state.get("state")
             if state is None:
                 st.info("Run a simulation first!")
             else:
                 show_insights(state=state)
+        elif action=="Performance":
+            show_performance(recorder.load_runs())
     except Exception as e:
         print(f"ERROR: in main function {str(e)}")
         print(f"{type(e).__name__}")
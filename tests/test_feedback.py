@@ -0,0 +1,49 @@
+import os
+import datetime
+
+from streamlit.testing.v1 import AppTest
+
+from agent import recommendations
+from agent import utils
+from agent.graph import new_state
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+META = {"from": ["hos_1"],"to": "hos_2","resource": "oxygen","quantity": 5}
+
+
+class NoOffsets:
+    """Stands in for the preference attributor, rejections leave the weights alone"""
+
+    def offsets(self,feedback: str,justification: str):
+        return {}
+
+
+def rejected_state(monkeypatch):
+    monkeypatch.setattr(recommendations,"get_attributor",lambda: NoOffsets())
+    state = new_state(recommendation="Transfer 5 units of oxygen from hos_1 to hos_2",recommendation_meta=dict(META))
+    return recommendations.get_feedback(state,approval=False,reason="too far")
+
+def test_reject_then_next_day(monkeypatch):
+    state = rejected_state(monkeypatch)
+    start = new_state()["sim_date"]
+    assert state["sim_date"] == start
+    assert state["recommendation_rejected"]
+
+    state = recommendations.advance_day(state)
+    assert state["sim_date"] == start + datetime.timedelta(days=1)
+    assert state["days_since_update"] == 1
+    assert not state["recommendation_rejected"]
+
+def test_next_day_button_after_reject(monkeypatch,tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils,"preload_model",lambda: None)
+    app = AppTest.from_file(os.path.join(REPO_ROOT,"main.py"),default_timeout=30)
+    app.session_state["state"] = rejected_state(monkeypatch)
+    app.run()
+    app.sidebar.selectbox[0].select("Recommend").run()
+
+    next_day = [button for button in app.button if button.label == "Next Day"]
+    assert next_day
+    next_day[0].click().run()
+    assert not app.exception
+    assert app.session_state["state"]["sim_date"] == new_state()["sim_date"] + datetime.timedelta(days=1)